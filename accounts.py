@@ -0,0 +1,295 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from domains import interleave
+from quota import SendQuota
+from rate_limit import AdaptiveRateLimiter, DEFAULT_RATE
+from send_engine import DEFAULT_CONNECTIONS, SMTP_HOST, SMTP_PORT, SendEngine
+
+# Multi-account sending. A campaign's jobs are spread over several sender
+# accounts or SMTP relays, each with its own connections (its weight), rate
+# limiter and daily quota. An account that reaches its quota stops taking
+# jobs; one that fails (login refused, sender refused, connections lost)
+# is taken out and its jobs move to the remaining accounts.
+
+ACTIVE = 'active'
+EXHAUSTED = 'quota reached'
+DOWN = 'failed'
+
+
+class Account:
+    def __init__(self, sender_email, password, host=SMTP_HOST, port=SMTP_PORT, starttls=True,
+                 connections=DEFAULT_CONNECTIONS, max_rate=DEFAULT_RATE, per_day=None, sent_today=0,
+                 name=None):
+        # per_day=None means no daily limit; sent_today seeds it, usually
+        # from SendJournal.sent_last_day(sender_email).
+        self.name = name or sender_email
+        self.sender_email = sender_email
+        self.password = password
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.connections = connections
+        self.max_rate = max_rate
+        self.quota = SendQuota(None, per_day, sent_today)
+        self.limiter = AdaptiveRateLimiter(max_rate=max_rate)
+        self.engine = None
+        self.state = ACTIVE
+        self.reason = ''
+        self.sent = 0
+        self.failed = 0
+        self.failovers = 0
+        self.in_flight = 0
+        self.started = None
+        self.last = None
+
+    @property
+    def weight(self):
+        return self.engine.size if self.engine is not None else 0
+
+    def take_down(self, reason):
+        self.state = DOWN
+        self.reason = reason
+
+    def report(self):
+        seconds = (self.last - self.started) if self.started is not None and self.last is not None else 0.0
+        return {
+            'account': self.name,
+            'host': self.host,
+            'state': self.state,
+            'reason': self.reason,
+            'connections': self.weight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'moved_away': self.failovers,
+            'seconds': seconds,
+            'emails_per_second': self.sent / seconds if seconds else 0.0,
+            'rate': self.limiter.rate,
+            'throttles': self.limiter.throttles,
+            'remaining_today': self.quota.remaining(),
+        }
+
+
+def load_accounts(path, defaults=None, sent_today=None, prompt=None):
+    # JSON list of objects: sender (required), password_env or password,
+    # host, port, starttls, connections, max_rate, per_day, name. Keys an
+    # entry leaves out come from defaults. sent_today(sender) seeds each
+    # daily quota; prompt(sender) supplies a password that is neither in
+    # the file nor in the environment.
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} must hold a non-empty JSON list of accounts")
+    defaults = dict(defaults or ())
+    accounts = []
+    for entry in entries:
+        sender = entry.get('sender')
+        if not sender:
+            raise ValueError(f"{path}: every account needs a 'sender'")
+        password = entry.get('password')
+        if password is None and entry.get('password_env'):
+            password = os.environ.get(entry['password_env'])
+        if password is None and prompt is not None:
+            password = prompt(sender)
+        settings = {key: entry.get(key, defaults.get(key))
+                    for key in ('host', 'port', 'starttls', 'connections', 'max_rate', 'per_day')}
+        accounts.append(Account(
+            sender, password,
+            host=settings['host'] or SMTP_HOST, port=settings['port'] or SMTP_PORT,
+            starttls=True if settings['starttls'] is None else settings['starttls'],
+            connections=settings['connections'] or DEFAULT_CONNECTIONS,
+            max_rate=settings['max_rate'] or DEFAULT_RATE,
+            per_day=settings['per_day'] or None,
+            sent_today=sent_today(sender) if sent_today is not None else 0,
+            name=entry.get('name'),
+        ))
+    return accounts
+
+
+class AccountPool:
+    """Drop-in for SendEngine that shards send_all over several accounts.
+
+    Each job goes to the active account with the fewest jobs in flight per
+    connection that still has quota for it. Metrics phases and the optional
+    domains.DomainLimiter are shared; results are recorded once, after any
+    failover.
+    """
+
+    def __init__(self, accounts, metrics=None, retries=3, domains=None):
+        self.accounts = list(accounts)
+        self.metrics = metrics
+        self.retries = retries
+        self.domains = domains
+        self._lock = threading.Lock()
+
+    @property
+    def sender_email(self):
+        return self.accounts[0].sender_email
+
+    @property
+    def host(self):
+        return ', '.join(sorted({account.host for account in self.accounts}))
+
+    @property
+    def size(self):
+        return sum(account.weight for account in self.accounts if account.state == ACTIVE)
+
+    @property
+    def throttles(self):
+        return sum(account.limiter.throttles for account in self.accounts)
+
+    @property
+    def rate(self):
+        return sum(account.limiter.rate for account in self.accounts if account.state == ACTIVE)
+
+    def open(self):
+        # Accounts that cannot log in are taken out; the first error is
+        # raised only if none can.
+        errors = []
+        for account in self.accounts:
+            engine = SendEngine(account.sender_email, account.password, connections=account.connections,
+                                host=account.host, port=account.port, limiter=account.limiter,
+                                retries=self.retries, metrics=self.metrics, starttls=account.starttls,
+                                domains=self.domains)
+            try:
+                engine.open()
+            except Exception as e:
+                errors.append(e)
+                account.take_down(str(e))
+                continue
+            account.engine = engine
+        if not any(account.engine is not None for account in self.accounts):
+            raise errors[0]
+        return self
+
+    def close(self):
+        for account in self.accounts:
+            if account.engine is not None:
+                account.engine.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def report(self):
+        return [account.report() for account in self.accounts]
+
+    def _pick(self, need):
+        # Least loaded active account, relative to its weight, that has a
+        # free slot and quota for `need` recipients. An account whose limiter
+        # is pausing after a throttle only gets jobs when every other one is.
+        with self._lock:
+            candidates = [account for account in self.accounts
+                          if account.state == ACTIVE and account.in_flight < account.weight * 2]
+            if not all(account.limiter.paused for account in candidates):
+                candidates = [account for account in candidates if not account.limiter.paused]
+            candidates.sort(key=lambda account: account.in_flight / account.weight)
+            for account in candidates:
+                granted = account.quota.take(need)
+                if granted == need:
+                    account.in_flight += 1
+                    return account
+                account.quota.release(granted)
+                if account.quota.exhausted:
+                    account.state = EXHAUSTED
+            return None
+
+    def _usable(self):
+        return any(account.state == ACTIVE for account in self.accounts)
+
+    def send_all(self, jobs, on_result=None, checkpoint=None):
+        # Same contract as SendEngine.send_all. Jobs that no account can
+        # take any more (all quotas reached) are left unsent, like rows
+        # over the campaign quota; failures only count once every account
+        # has been tried or has gone down.
+        results = []
+        pending = {}
+        retry = deque()
+        if self.domains is not None:
+            jobs = interleave(jobs, self.domains)
+        jobs = iter(jobs)
+        exhausted = False
+
+        def report(result, account):
+            results.append(result)
+            if account is not None:
+                account.last = time.monotonic()
+                if result.ok:
+                    account.sent += 1
+                else:
+                    account.failed += 1
+            if self.metrics is not None:
+                self.metrics.record(result)
+            if on_result is not None:
+                on_result(result)
+
+        while True:
+            while self._usable():
+                if retry:
+                    job, failures = retry.popleft()
+                elif exhausted:
+                    break
+                else:
+                    if checkpoint is not None:
+                        # Same contract as in SendEngine.send_all
+                        go = checkpoint(block=not pending)
+                        if go is None:
+                            break
+                        if not go:
+                            exhausted = True
+                            break
+                    try:
+                        job, failures = next(jobs), None
+                    except StopIteration:
+                        exhausted = True
+                        break
+                index, recipient, message = job
+                account = self._pick(len(recipient) if isinstance(recipient, list) else 1)
+                if account is None:
+                    retry.appendleft((job, failures))
+                    break
+                if account.started is None:
+                    account.started = time.monotonic()
+                pending[account.engine.submit(index, recipient, message, record=False)] = (account, job)
+            if not pending:
+                break
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                account, job = pending.pop(future)
+                with self._lock:
+                    account.in_flight -= 1
+                batch = future.result()
+                batch = batch if isinstance(batch, list) else [batch]
+                moved = [result for result in batch if result.sender_failed]
+                if moved:
+                    with self._lock:
+                        if account.state == ACTIVE:
+                            account.take_down(moved[0].error)
+                        account.quota.release(len(moved))
+                        account.failovers += len(moved)
+                    if self._usable():
+                        retry.append((self._remaining(job, moved), moved))
+                        batch = [result for result in batch if not result.sender_failed]
+                for result in batch:
+                    report(result, account)
+
+        # Nothing can send these any more: every account is down or at its
+        # quota. Jobs that already failed on an account report that failure;
+        # the others stay queued in the journal for a later run.
+        for job, failures in retry:
+            for result in failures or ():
+                report(result, None)
+        return results
+
+    def _remaining(self, job, moved):
+        # The part of a job that has to be sent again elsewhere.
+        index, recipient, message = job
+        if not isinstance(recipient, list):
+            return job
+        return [result.index for result in moved], [result.recipient for result in moved], message
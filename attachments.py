@@ -0,0 +1,136 @@
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+
+# Disk-backed attachments. Each upload is streamed once into a cached,
+# ready-to-send MIME part (headers plus base64 body with CRLF line endings)
+# named after the hash of its filename and content. Messages then refer to
+# the file instead of carrying the encoded bytes, and the sender streams it
+# onto the socket, so memory does not grow with attachment size or
+# recipient count.
+
+DEFAULT_DIR = os.environ.get(
+    "MAIL_ATTACHMENT_CACHE",
+    os.path.join(os.path.expanduser("~"), ".mailautomation", "attachments"),
+)
+# 57 input bytes make one 76-character base64 line, so every block but the
+# last encodes to whole lines.
+READ_BLOCK = 57 * 1024
+CACHE_BYTES = 2 << 30
+SUFFIX = '.part'
+
+# Parts that queued or running jobs of this process still have to send,
+# with how many of them do; eviction leaves these alone.
+_pinned = {}
+_pinned_lock = threading.Lock()
+
+
+class EncodedAttachment:
+    def __init__(self, filename, path, size):
+        # size is the encoded part's size in bytes, as sent.
+        self.filename = filename
+        self.path = path
+        self.size = size
+
+    def __repr__(self):
+        return f"EncodedAttachment({self.filename!r}, {self.path!r}, {self.size})"
+
+
+def part_headers(filename):
+    # Same headers message_builder.attachment_part would produce.
+    from message_builder import attachment_part, serialize_part
+
+    serialized = serialize_part(attachment_part(filename, b''))
+    return serialized[:serialized.index(b'\r\n\r\n') + 4]
+
+
+class AttachmentCache:
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, filename, source, pin=False):
+        # source is bytes or a binary file object, read in blocks from its
+        # current position. Returns an EncodedAttachment for MessageBuilder.
+        # pin=True keeps the part from being evicted until release().
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = memoryview(source)
+            blocks = (data[start:start + READ_BLOCK] for start in range(0, len(data), READ_BLOCK))
+        else:
+            blocks = iter(lambda: source.read(READ_BLOCK), b'')
+
+        digest = hashlib.sha256(filename.encode('utf-8') + b'\0')
+        fd, partial = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(part_headers(filename))
+                for block in blocks:
+                    digest.update(block)
+                    f.write(base64.encodebytes(block).replace(b'\n', b'\r\n'))
+            path = os.path.join(self.directory, digest.hexdigest() + SUFFIX)
+            if pin:
+                _pin(path)
+            if os.path.exists(path):
+                # Encoded before: keep the cached copy and mark it as used.
+                os.remove(partial)
+                os.utime(path)
+            else:
+                os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            if pin:
+                _unpin(path)
+            raise
+        self._evict(keep=path)
+        return EncodedAttachment(filename, path, os.path.getsize(path))
+
+    def _evict(self, keep):
+        # Drop least recently used parts once the cache is over max_bytes.
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        with _pinned_lock:
+            pinned = set(_pinned)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep or path in pinned:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def _pin(path):
+    with _pinned_lock:
+        _pinned[path] = _pinned.get(path, 0) + 1
+
+
+def _unpin(path):
+    with _pinned_lock:
+        if _pinned.get(path, 0) > 1:
+            _pinned[path] -= 1
+        else:
+            _pinned.pop(path, None)
+
+
+def release(attachments):
+    # Undoes add(..., pin=True) once the job sending them is over. Entries
+    # that are not EncodedAttachment (in-memory pairs) are ignored.
+    for attachment in attachments:
+        if isinstance(attachment, EncodedAttachment):
+            _unpin(attachment.path)
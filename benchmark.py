@@ -0,0 +1,153 @@
+import argparse
+import io
+import itertools
+import json
+import tempfile
+import time
+import tracemalloc
+
+from attachments import AttachmentCache
+from smtp_sink import SMTPSink
+
+# Benchmark of the bulk send path against the local SMTP sink. Each scenario
+# renders and sends a synthetic campaign headlessly and reports throughput,
+# per-recipient latency and peak Python memory, so changes to the send path
+# can be compared run over run.
+#
+#   python benchmark.py --recipients 200 1000 --attachment-kb 0 1024
+
+FILLER = "The quick brown fox jumps over the lazy dog. "
+
+
+def make_recipients(count, columns):
+    import pandas as pd
+
+    data = {'email': [f'user{i}@example.com' for i in range(count)]}
+    for c in range(columns):
+        data[f'field{c}'] = [f'value{c}-{i}' for i in range(count)]
+    return pd.DataFrame(data)
+
+
+def make_template(size_kb, columns):
+    placeholders = ' '.join(f'{{field{c}}}' for c in range(columns))
+    text = f"Hello {placeholders}\n"
+    target = size_kb * 1024
+    while len(text) < target:
+        text += FILLER
+        if len(text) % 80 < len(FILLER):
+            text += '\n'
+    return text
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_scenario(sink, cache, recipients, template_kb, columns, attachment_kb, connections, max_rate, chunksize,
+                 render_workers=1, fanout=1):
+    from campaign import Campaign
+    from message_builder import MessageBuilder
+    from metrics import SendMetrics
+    from rate_limit import AdaptiveRateLimiter
+    from send_engine import SendEngine
+    from template import compile_template
+    from validation import RecipientValidator
+
+    frame = make_recipients(recipients, columns)
+    memo = {column: column for column in frame.columns}
+    messages_before = sink.stats.messages
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    attachments = []
+    if attachment_kb:
+        # Encoded into the on-disk cache and streamed, as the app does
+        attachments.append(cache.add('attachment.bin', io.BytesIO(b'\0' * (attachment_kb * 1024))))
+    builder = MessageBuilder('bench@example.com', attachments)
+    run = Campaign('bench@example.com', 'email',
+                   compile_template(make_template(template_kb, columns), memo),
+                   compile_template('Benchmark for {field0}' if columns else 'Benchmark', memo),
+                   builder, metrics=SendMetrics(), fanout=fanout)
+    validator = RecipientValidator('email')
+    chunks = (validator.apply(frame.iloc[start:start + chunksize]) for start in range(0, len(frame), chunksize))
+    engine = SendEngine('bench', 'bench', connections=connections, host=sink.host, port=sink.port,
+                        starttls=False, limiter=AdaptiveRateLimiter(max_rate=max_rate), metrics=run.metrics)
+    with engine:
+        results = run.run(engine, chunks, render_workers=render_workers)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = [result.elapsed for result in results]
+    sent = sum(1 for result in results if result.ok)
+    return {
+        'recipients': recipients,
+        'template_kb': template_kb,
+        'columns': columns,
+        'attachment_kb': attachment_kb,
+        'connections': connections,
+        'render_workers': render_workers,
+        'fanout': fanout,
+        'sent': sent,
+        'failed': len(results) - sent,
+        'delivered': sink.stats.messages - messages_before,
+        'seconds': elapsed,
+        'messages_per_second': len(results) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'peak_mb': peak / (1 << 20),
+        'phases': {name: phase['mean'] * 1000 for name, phase in
+                   run.metrics.to_dict(include_recipients=False)['phases'].items()},
+    }
+
+
+def format_row(row):
+    return (f"{row['recipients']:>7} {row['template_kb']:>6} {row['columns']:>5} {row['attachment_kb']:>8} "
+            f"{row['connections']:>5} {row['render_workers']:>7} {row['messages_per_second']:>9.1f} {row['p50_ms']:>8.1f} "
+            f"{row['p99_ms']:>8.1f} {row['peak_mb']:>8.1f} {row['failed']:>6}")
+
+
+HEADER = (f"{'rcpts':>7} {'tplKB':>6} {'cols':>5} {'attachKB':>8} {'conns':>5} {'workers':>7} {'msg/s':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'peak MB':>8} {'failed':>6}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bulk send path against a local SMTP sink.")
+    parser.add_argument("--recipients", type=int, nargs='+', default=[200, 1000])
+    parser.add_argument("--template-kb", type=int, nargs='+', default=[1, 16])
+    parser.add_argument("--columns", type=int, nargs='+', default=[2, 16])
+    parser.add_argument("--attachment-kb", type=int, nargs='+', default=[0, 1024])
+    parser.add_argument("--connections", type=int, nargs='+', default=[4])
+    parser.add_argument("--render-workers", type=int, nargs='+', default=[1])
+    parser.add_argument("--fanout", type=int, default=1,
+                        help="recipients per transaction for scenarios without variables (--columns 0)")
+    parser.add_argument("--max-rate", type=float, default=10000.0, help="rate limiter ceiling, emails/second")
+    parser.add_argument("--chunksize", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.005, help="sink delay before every reply, seconds")
+    parser.add_argument("--throttle-rate", type=float, default=None, help="sink messages/second before 451")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="sink probability of a 550 on RCPT TO")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    rows = []
+    sink = SMTPSink(latency=args.latency, throttle_rate=args.throttle_rate, error_rate=args.error_rate, seed=0)
+    with tempfile.TemporaryDirectory() as directory, sink:
+        cache = AttachmentCache(directory)
+        print(HEADER)
+        for recipients, template_kb, columns, attachment_kb, connections, render_workers in itertools.product(
+                args.recipients, args.template_kb, args.columns, args.attachment_kb, args.connections,
+                args.render_workers):
+            row = run_scenario(sink, cache, recipients, template_kb, columns, attachment_kb, connections,
+                               args.max_rate, args.chunksize, render_workers, args.fanout)
+            rows.append(row)
+            print(format_row(row), flush=True)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import time
+
+from send_engine import SendResult
+
+# Headless bulk campaign: turns validated recipient chunks into rendered
+# messages and drives a SendEngine with them. Used by the Streamlit job, the
+# benchmark harness and anything else that sends without a UI.
+
+# Recipients per SMTP transaction when every message is identical.
+DEFAULT_FANOUT = 50
+MAX_FANOUT = 100
+UNDISCLOSED = 'undisclosed-recipients:;'
+
+
+class BuildError(ValueError):
+    # Stands in for the message of a row that could not be built (see
+    # render_batch); the row is reported as failed instead of sent.
+    pass
+
+
+class Campaign:
+    def __init__(self, sender_email, emailcolumn, body_template, subject_template, builder,
+                 campaign_id=None, journal=None, already_sent=None, quota=None, metrics=None, fanout=1):
+        # body_template/subject_template are template.CompiledTemplate,
+        # builder is a message_builder.MessageBuilder. journal, quota and
+        # metrics are optional. fanout > 1 sends templates without variables
+        # as one message per that many recipients (see fanout_messages).
+        self.sender_email = sender_email
+        self.emailcolumn = emailcolumn
+        self.body_template = body_template
+        self.subject_template = subject_template
+        self.builder = builder
+        self.campaign_id = campaign_id
+        self.journal = journal
+        self.already_sent = already_sent or set()
+        self.quota = quota
+        self.metrics = metrics
+        self.fanout = max(1, min(int(fanout), MAX_FANOUT))
+        self.skipped = 0
+        self.queued = 0
+
+    def _select(self, chunk):
+        # Skip rows the journal already has as sent, before anything is rendered
+        if self.already_sent:
+            pending = chunk[~chunk.index.astype(str).isin(self.already_sent)]
+            self.skipped += len(chunk) - len(pending)
+            chunk = pending
+        if self.quota is not None:
+            chunk = chunk.iloc[:self.quota.take(len(chunk))]
+        return chunk
+
+    @property
+    def columns(self):
+        # Columns a message actually needs; everything else is dropped before
+        # rows are handed to the renderers.
+        return needed_columns(self.emailcolumn, self.subject_template, self.body_template)
+
+    def batches(self, chunks):
+        # Selected, journaled chunks as recipients.RecipientBatch, ready to
+        # render; the DataFrame is let go here.
+        from recipients import RecipientBatch
+
+        columns = self.columns
+        for chunk in chunks:
+            chunk = self._select(chunk)
+            if len(chunk) == 0:
+                if self.quota is not None and self.quota.exhausted:
+                    return
+                continue
+            batch = RecipientBatch.from_frame(chunk, self.emailcolumn, columns)
+            del chunk
+            if self.journal is not None:
+                self.journal.mark_queued(self.campaign_id, zip(batch.keys, batch.emails))
+            self.queued += len(batch)
+            yield batch
+
+    @property
+    def identical(self):
+        # No variables in subject or body: every recipient gets the same text.
+        return self.body_template.is_static and self.subject_template.is_static
+
+    def messages(self, chunks, render_workers=1):
+        # Yields jobs for send_engine: fan-out batches when every message is
+        # identical and fanout > 1, otherwise one rendered message per row.
+        if self.fanout > 1 and self.identical:
+            return self.fanout_messages(chunks)
+        return self.rendered(chunks, render_workers)
+
+    def rendered(self, chunks, render_workers=1):
+        # Yields (row index, recipient, message bytes). With
+        # render_workers > 1 rendering runs in a process pool ahead of the
+        # senders (see pipeline.RenderPipeline).
+        if render_workers > 1:
+            from pipeline import RenderPipeline
+
+            pipeline = RenderPipeline(self.body_template, self.subject_template, self.builder,
+                                      workers=render_workers, metrics=self.metrics)
+            yield from pipeline.messages(self.batches(chunks))
+            return
+        for batch in self.batches(chunks):
+            yield from render_batch(self.body_template, self.subject_template, self.builder, batch, self.metrics)
+
+    def fanout_messages(self, chunks):
+        # Yields ([row index, ...], [recipient, ...], message bytes): the
+        # message is built once, addressed to undisclosed recipients, and
+        # each batch goes out as one transaction with many RCPT TO, so the
+        # DATA payload is sent once per batch instead of once per recipient.
+        message = None
+        for batch in self.batches(chunks):
+            if message is None:
+                serializing = time.perf_counter()
+                message = self.builder.build(UNDISCLOSED, self.subject_template.render({}),
+                                             self.body_template.render({}))
+                if self.metrics is not None:
+                    self.metrics.observe('serialize', time.perf_counter() - serializing)
+            for part in batch.slices(self.fanout):
+                yield part.keys, part.emails, message
+
+    def _built(self, jobs, report):
+        # Rows whose message could not be built go to report as failed
+        # SendResults; every other job is passed on.
+        for index, recipient, message in jobs:
+            if isinstance(message, BuildError):
+                result = SendResult(index, recipient, False, str(message))
+                if self.metrics is not None:
+                    self.metrics.record(result)
+                report(result)
+                continue
+            yield index, recipient, message
+
+    def run(self, engine, chunks, on_result=None, checkpoint=None, render_workers=1):
+        # engine must already be open. Results are journaled before being
+        # passed on to on_result.
+        if self.journal is not None:
+            self.journal.register(self.campaign_id, self.sender_email)
+        unbuilt = []
+
+        def handle(result):
+            if self.journal is not None:
+                self.journal.record(self.campaign_id, result)
+            if on_result is not None:
+                on_result(result)
+
+        def report(result):
+            unbuilt.append(result)
+            handle(result)
+
+        jobs = self._built(self.messages(chunks, render_workers), report)
+        return unbuilt + engine.send_all(jobs, on_result=handle, checkpoint=checkpoint)
+
+    def spool(self, writer, chunks, checkpoint=None, render_workers=1, on_result=None):
+        # Render to an on-disk spool (spool.create_spool) instead of
+        # sending. Returns the number of messages written; rows whose
+        # message could not be built are left out and passed to on_result.
+        # A spool cut short by checkpoint() is discarded, so it is never
+        # drained as if it were complete.
+        messages = self.rendered(chunks, render_workers)
+        jobs = self._built(messages, on_result or (lambda result: None))
+        try:
+            for index, recipient_email, message in jobs:
+                if checkpoint is not None and not checkpoint():
+                    writer.discard()
+                    break
+                writer.add(index, recipient_email, message)
+        finally:
+            messages.close()
+        return writer.count
+
+
+def needed_columns(emailcolumn, *templates):
+    # The email column, then every column the templates refer to. Passed as
+    # ingest's columns= so nothing else is read from the file.
+    needed = [emailcolumn]
+    for template in templates:
+        for column in template.columns:
+            if column not in needed:
+                needed.append(column)
+    return needed
+
+
+def render_batch(body_template, subject_template, builder, batch, metrics=None):
+    # Render subjects and bodies column-wise instead of row by row, then
+    # serialize each message.
+    rendering = time.perf_counter()
+    subjects = subject_template.render_batch(batch)
+    bodies = body_template.render_batch(batch)
+    if metrics is not None:
+        metrics.observe('render', (time.perf_counter() - rendering) / len(batch), count=len(batch))
+    for index, recipient_email, subject, body in zip(batch.keys, batch.emails, subjects, bodies):
+        serializing = time.perf_counter()
+        try:
+            message = builder.build(recipient_email, subject, body)
+        except Exception as e:
+            # One bad row (say a line break in a subject field) fails alone
+            yield index, recipient_email, BuildError(f"could not build message: {e}")
+            continue
+        if metrics is not None:
+            metrics.observe('serialize', time.perf_counter() - serializing)
+        yield index, recipient_email, message
@@ -0,0 +1,333 @@
+import argparse
+import getpass
+import os
+import sys
+
+# Headless command-line sender for scheduled and cron-driven campaigns. It
+# reuses the same ingestion, templating, journal and send engine as the
+# Streamlit page. Only argparse is imported up front; everything else is
+# imported when the code path needs it, so --help starts instantly.
+#
+#   python cli.py --recipients list.csv --template body.txt \
+#       --subject "Hello {name}" --sender me@gmail.com --attach offer.pdf
+#
+# With --spool the messages are only rendered to disk; --drain sends such a
+# spool later.
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_ERROR = 2
+
+
+def parse_mapping(values):
+    # "column=variable" pairs; a bare "column" maps to itself.
+    memo = {}
+    for value in values or ():
+        column, _, variable = value.partition('=')
+        memo[column.strip()] = (variable or column).strip()
+    return memo
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Send a personalized bulk email campaign without the web UI.",
+    )
+    parser.add_argument("--recipients", help="CSV, TSV, XLSX or XLS file with recipient data")
+    parser.add_argument("--template", help="plain text template file using {variable} placeholders")
+    parser.add_argument("--subject", help="subject line, may use {variable} placeholders")
+    parser.add_argument("--sender", help="Gmail address to send from (with --drain: the spool's sender)")
+    parser.add_argument("--password-env", default="MAIL_PASSWORD",
+                        help="environment variable holding the app password (default: MAIL_PASSWORD); "
+                             "prompted for when unset")
+    parser.add_argument("--accounts", metavar="FILE",
+                        help="JSON list of sending accounts or relays to share the campaign "
+                             "(see README); replaces --password-env")
+    parser.add_argument("--email-column", help="column with recipient addresses (auto-detected by default)")
+    parser.add_argument("--keep", choices=("first", "last", "all"), default="first",
+                        help="which row to send when an address appears more than once (default: first)")
+    parser.add_argument("--suppress", metavar="FILE",
+                        help="addresses never to email, one per line; @domain skips a whole domain")
+    parser.add_argument("--no-split", action="store_true",
+                        help="treat a cell as one address instead of splitting it on ',' or ';'")
+    parser.add_argument("--rejects", metavar="PATH", help="write the rows that will not be sent, with the reason, as CSV")
+    parser.add_argument("--map", action="append", metavar="COLUMN=VARIABLE",
+                        help="map a column to a template variable; repeatable. "
+                             "Default: every column maps to its own name")
+    parser.add_argument("--attach", action="append", default=[], metavar="FILE", help="attachment; repeatable")
+    parser.add_argument("--connections", type=int, default=None, help="parallel SMTP connections")
+    parser.add_argument("--render-workers", type=int, default=1,
+                        help="processes that render and encode messages ahead of the senders")
+    parser.add_argument("--fanout", type=int, default=None,
+                        help="when subject and body have no variables, send one message per this many "
+                             "recipients as blind copies (default: 50; 1 sends one message each)")
+    parser.add_argument("--max-rate", type=float, default=None, help="maximum emails/second")
+    parser.add_argument("--per-domain", type=int, default=None,
+                        help="transactions in flight per recipient domain (default: no limit). Recipients "
+                             "are always interleaved across domains, and a domain that defers them is paused")
+    parser.add_argument("--domain-rate", type=float, default=None,
+                        help="maximum emails/second per recipient domain (default: unlimited)")
+    parser.add_argument("--max-per-run", type=int, default=None, help="stop after this many emails (0 = unlimited)")
+    parser.add_argument("--max-per-day", type=int, default=None, help="rolling 24-hour limit (0 = unlimited)")
+    parser.add_argument("--chunksize", type=int, default=None, help="rows read per chunk")
+    parser.add_argument("--journal", default=None, help="send journal path (default: MAIL_JOURNAL or ~/.mailautomation)")
+    parser.add_argument("--no-resume", action="store_true", help="send again to rows already marked sent")
+    parser.add_argument("--host", default=None, help="SMTP host (default: smtp.gmail.com)")
+    parser.add_argument("--port", type=int, default=None, help="SMTP port (default: 587)")
+    parser.add_argument("--no-starttls", action="store_true", help="plain connection, for local test servers only")
+    parser.add_argument("--metrics-json", metavar="PATH", help="write send metrics as JSON")
+    parser.add_argument("--metrics-prom", metavar="PATH", help="write send metrics in Prometheus text format")
+    parser.add_argument("--spool", metavar="PATH",
+                        help="render every message to a spool at PATH instead of sending (dry run)")
+    parser.add_argument("--spool-format", choices=("maildir", "bulk"), default="maildir",
+                        help="maildir directory or single length-prefixed bulk file (default: maildir)")
+    parser.add_argument("--drain", metavar="PATH", help="send a spool written earlier with --spool")
+    parser.add_argument("--quiet", action="store_true", help="only print the final summary")
+    return parser
+
+
+def check_args(parser, args):
+    if args.drain:
+        if args.spool:
+            parser.error("--spool and --drain cannot be combined")
+        return
+    missing = [f"--{name}" for name in ('recipients', 'template', 'subject', 'sender')
+               if not getattr(args, name)]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+
+
+def open_journal(args, campaign, sender):
+    # Journal, rows already sent in earlier runs, and the send quota.
+    from journal import DEFAULT_PATH, SendJournal
+    from quota import DEFAULT_PER_DAY, DEFAULT_PER_RUN, SendQuota
+
+    journal = SendJournal(args.journal or DEFAULT_PATH)
+    already_sent = set() if args.no_resume else journal.completed(campaign)
+    per_run = DEFAULT_PER_RUN if args.max_per_run is None else args.max_per_run
+    per_day = DEFAULT_PER_DAY if args.max_per_day is None else args.max_per_day
+    if args.accounts:
+        # Daily limits are kept per account instead
+        per_day = 0
+    quota = SendQuota(per_run or None, per_day or None, journal.sent_last_day(sender))
+    if quota.exhausted:
+        print("error: sending limit reached; try again later or raise --max-per-day", file=sys.stderr)
+    return journal, already_sent, quota
+
+
+def make_engine(args, sender, journal, metrics):
+    # One SendEngine, or an AccountPool sharding the run over --accounts.
+    # Returns the engine and what reports its throttling.
+    from domains import DEFAULT_PER_DOMAIN, DomainLimiter
+    from quota import DEFAULT_PER_DAY
+    from rate_limit import DEFAULT_RATE, AdaptiveRateLimiter
+    from send_engine import DEFAULT_CONNECTIONS, SMTP_HOST, SMTP_PORT, SendEngine
+
+    per_domain = DEFAULT_PER_DOMAIN if args.per_domain is None else args.per_domain
+    domains = DomainLimiter(per_domain, args.domain_rate)
+    if args.accounts:
+        from accounts import AccountPool, load_accounts
+
+        defaults = {
+            'host': args.host, 'port': args.port, 'starttls': not args.no_starttls,
+            'connections': args.connections, 'max_rate': args.max_rate,
+            'per_day': DEFAULT_PER_DAY if args.max_per_day is None else args.max_per_day,
+        }
+        accounts = load_accounts(args.accounts, defaults, sent_today=journal.sent_last_day,
+                                 prompt=lambda account: getpass.getpass(f"App password for {account}: "))
+        pool = AccountPool(accounts, metrics=metrics, domains=domains)
+        return pool, pool
+    password = os.environ.get(args.password_env) or getpass.getpass(f"App password for {sender}: ")
+    limiter = AdaptiveRateLimiter(max_rate=args.max_rate or DEFAULT_RATE)
+    engine = SendEngine(sender, password, connections=args.connections or DEFAULT_CONNECTIONS,
+                        host=args.host or SMTP_HOST, port=args.port or SMTP_PORT,
+                        limiter=limiter, metrics=metrics, starttls=not args.no_starttls, domains=domains)
+    return engine, limiter
+
+
+def validate(args, name, emailcolumn, digest):
+    # One pass over the email column before anything is sent: prints why
+    # rows are left out and writes them to --rejects. Returns a factory for
+    # the validator of the sending pass.
+    from ingest import DEFAULT_CHUNKSIZE, count_rows
+    from validation import REASONS, RecipientValidator, load_suppression
+
+    suppressed = load_suppression(args.suppress) if args.suppress else None
+
+    def make_validator():
+        return RecipientValidator(emailcolumn, args.keep, suppressed, split=not args.no_split)
+
+    validator = make_validator()
+    total, valid = count_rows(args.recipients, name, emailcolumn, args.chunksize or DEFAULT_CHUNKSIZE,
+                              digest=digest, validator=validator)
+    report = validator.report()
+    reasons = ", ".join(f"{report[reason]} {reason}" for reason in REASONS if reason in report)
+    print(f"{name}: {total} rows, {valid} to send" + (f"; left out: {reasons}" if reasons else ""),
+          file=sys.stderr)
+    if args.rejects:
+        validator.rejected.to_csv(args.rejects, index=False)
+    return make_validator
+
+
+def run(args):
+    if args.drain:
+        return drain(args)
+    from attachments import AttachmentCache
+    from campaign import DEFAULT_FANOUT, Campaign, needed_columns
+    from ingest import DEFAULT_CHUNKSIZE, content_digest, detect_email_column, iter_valid_chunks, read_columns
+    from journal import campaign_id
+    from message_builder import MessageBuilder
+    from metrics import SendMetrics
+    from template import compile_template
+
+    name = os.path.basename(args.recipients)
+    digest = content_digest(args.recipients)
+    columns = read_columns(args.recipients, name, digest=digest)
+    emailcolumn = args.email_column or detect_email_column(columns)
+    if emailcolumn not in columns:
+        print(f"error: email column {emailcolumn!r} not found in {name}", file=sys.stderr)
+        return EXIT_ERROR
+    memo = parse_mapping(args.map) if args.map else {column: str(column) for column in columns}
+    unknown = [column for column in memo if column not in columns]
+    if unknown:
+        print(f"error: mapped columns not in {name}: {', '.join(map(str, unknown))}", file=sys.stderr)
+        return EXIT_ERROR
+
+    with open(args.template, encoding='utf-8') as f:
+        message_template = f.read()
+    # Attachments are encoded once into the on-disk cache and streamed from there
+    cache = AttachmentCache()
+    attachments = []
+    for path in args.attach:
+        with open(path, 'rb') as f:
+            attachments.append(cache.add(os.path.basename(path), f))
+
+    campaign = campaign_id(args.sender, args.subject, message_template, memo, emailcolumn, digest)
+    body_template = compile_template(message_template, memo)
+    subject_template = compile_template(args.subject, memo)
+    builder = MessageBuilder(args.sender, attachments)
+    make_validator = validate(args, name, emailcolumn, digest)
+    chunks = iter_valid_chunks(args.recipients, name, emailcolumn, args.chunksize or DEFAULT_CHUNKSIZE,
+                               columns=needed_columns(emailcolumn, subject_template, body_template), digest=digest,
+                               validator=make_validator())
+
+    if args.spool:
+        # Dry run: every valid row is rendered; resume and quotas apply
+        # when the spool is drained.
+        from spool import create_spool
+
+        metrics = SendMetrics()
+        bulk = Campaign(args.sender, emailcolumn, body_template, subject_template, builder, metrics=metrics)
+        with create_spool(args.spool, args.spool_format, campaign=campaign, sender=args.sender) as writer:
+            written = bulk.spool(writer, chunks, render_workers=args.render_workers,
+                                 on_result=lambda result: print(f"failed: {result.recipient}: {result.error}",
+                                                                file=sys.stderr))
+        metrics.finish()
+        print(f"campaign {campaign}: spooled {written} messages to {args.spool} in {metrics.elapsed:.2f}s"
+              + (f", {metrics.failed} could not be built" if metrics.failed else ""))
+        return EXIT_OK
+
+    journal, already_sent, quota = open_journal(args, campaign, args.sender)
+    if quota.exhausted:
+        journal.close()
+        return EXIT_ERROR
+
+    metrics = SendMetrics()
+    bulk = Campaign(args.sender, emailcolumn, body_template, subject_template, builder,
+                    campaign_id=campaign, journal=journal, already_sent=already_sent,
+                    quota=quota, metrics=metrics,
+                    fanout=DEFAULT_FANOUT if args.fanout is None else args.fanout)
+    engine, limiter = make_engine(args, args.sender, journal, metrics)
+    return deliver(args, campaign, bulk, engine, journal, metrics, limiter,
+                   lambda on_result: bulk.run(engine, chunks, on_result=on_result,
+                                              render_workers=args.render_workers))
+
+
+def drain(args):
+    # Send a spool written earlier with --spool.
+    from metrics import SendMetrics
+    from spool import SpoolDrain, open_spool
+
+    spool = open_spool(args.drain)
+    sender = args.sender or spool.metadata.get('sender')
+    campaign = spool.metadata.get('campaign')
+
+    journal, already_sent, quota = open_journal(args, campaign, sender)
+    if quota.exhausted:
+        journal.close()
+        spool.close()
+        return EXIT_ERROR
+
+    metrics = SendMetrics()
+    bulk = SpoolDrain(spool, journal=journal, already_sent=already_sent, quota=quota)
+    engine, limiter = make_engine(args, sender, journal, metrics)
+    try:
+        return deliver(args, campaign, bulk, engine, journal, metrics, limiter,
+                       lambda on_result: bulk.run(engine, on_result=on_result))
+    finally:
+        spool.close()
+
+
+def deliver(args, campaign, bulk, engine, journal, metrics, limiter, send):
+    # Shared by a live run and a spool drain: send(on_result) does the
+    # sending over the not yet opened engine.
+    import time
+
+    last_report = [0.0]
+
+    def on_result(result):
+        if not result.ok:
+            print(f"failed: {result.recipient}: {result.error}", file=sys.stderr)
+        now = time.monotonic()
+        if not args.quiet and now - last_report[0] >= 1.0:
+            last_report[0] = now
+            print(f"sent {metrics.sent}, failed {metrics.failed}, skipped {bulk.skipped}", file=sys.stderr)
+
+    try:
+        engine.open()
+    except Exception as e:
+        print(f"error: could not connect to {engine.host}: {e}", file=sys.stderr)
+        journal.close()
+        return EXIT_ERROR
+    try:
+        send(on_result)
+    except KeyboardInterrupt:
+        print("interrupted; run again to resume", file=sys.stderr)
+    finally:
+        engine.close()
+        metrics.finish()
+        journal.close()
+
+    print(f"campaign {campaign}: sent {metrics.sent}, failed {metrics.failed}, "
+          f"skipped {bulk.skipped} (already sent), {metrics.elapsed:.2f}s, "
+          f"{metrics.throughput:.2f} emails/s, throttled {limiter.throttles}x")
+    for account in getattr(engine, 'report', list)():
+        print(f"  {account['account']}: {account['state']}, sent {account['sent']}, failed {account['failed']}, "
+              f"{account['emails_per_second']:.2f} emails/s"
+              + (f" ({account['reason']})" if account['reason'] else ""))
+    if engine.domains is not None:
+        for domain in engine.domains.report():
+            if domain['throttles']:
+                print(f"  {domain['domain']}: sent {domain['sent']}, deferred {domain['throttles']}x")
+    if args.metrics_json:
+        with open(args.metrics_json, 'w') as f:
+            f.write(metrics.to_json())
+    if args.metrics_prom:
+        with open(args.metrics_prom, 'w') as f:
+            f.write(metrics.to_prometheus(labels={'campaign': campaign}))
+    return EXIT_FAILURES if metrics.failed else EXIT_OK
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    check_args(parser, args)
+    try:
+        return run(args)
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Recipient-domain scheduling. Lists are usually skewed towards a few
+# receiving domains, and a burst of messages at one of them gets the sender
+# deferred. interleave() reorders send jobs round-robin across domains and
+# holds back domains that are at their limits; DomainLimiter, shared with the
+# SendEngine workers, enforces optional per-domain concurrency and rate caps
+# and pauses a domain that answers with temporary failures while the others
+# keep flowing. By default there is no cap: a list that is mostly one domain
+# (gmail.com) still uses every connection, and only a domain that defers
+# recipients is slowed down.
+
+DEFAULT_PER_DOMAIN = None
+DEFAULT_WINDOW = 500
+MAX_DOMAIN_COOLDOWN = 60.0
+
+
+def domain_of(address):
+    return str(address).rpartition('@')[2].strip().lower()
+
+
+def job_domains(recipient):
+    # Domains of a job's recipient, or of every recipient of a fan-out batch.
+    if isinstance(recipient, list):
+        return sorted({domain_of(address) for address in recipient})
+    return [domain_of(recipient)]
+
+
+class _Domain:
+    def __init__(self, burst):
+        self.active = 0
+        self.reserved = 0
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.paused_until = 0.0
+        self.strikes = 0
+        self.throttles = 0
+        self.sent = 0
+
+
+class DomainLimiter:
+    def __init__(self, per_domain=DEFAULT_PER_DOMAIN, rate=None, cooldown=2.0):
+        # per_domain: transactions in flight per domain; rate: messages per
+        # second per domain. None or 0 for no cap.
+        self.per_domain = max(1, int(per_domain)) if per_domain else None
+        self.rate = float(rate) if rate else None
+        self.cooldown = cooldown
+        self._domains = {}
+        self._changed = threading.Condition()
+
+    def _get(self, name):
+        domain = self._domains.get(name)
+        if domain is None:
+            domain = self._domains[name] = _Domain(1.0)
+        return domain
+
+    def _refill(self, domain, now):
+        if self.rate is not None:
+            domain.tokens = min(1.0, domain.tokens + (now - domain.last) * self.rate)
+        domain.last = now
+
+    def _delay(self, names, now, reserved=True):
+        # Seconds until every domain can start one more transaction; 0 means
+        # now, None means once a transaction in flight finishes.
+        delay = 0.0
+        for name in names:
+            domain = self._get(name)
+            load = domain.active + (domain.reserved if reserved else 0)
+            if self.per_domain is not None and load >= self.per_domain:
+                return None
+            self._refill(domain, now)
+            if now < domain.paused_until:
+                delay = max(delay, domain.paused_until - now)
+            elif self.rate is not None and domain.tokens < 1:
+                delay = max(delay, (1 - domain.tokens) / self.rate)
+        return delay
+
+    def ready(self, names):
+        with self._changed:
+            return self._delay(names, time.monotonic()) == 0
+
+    def reserve(self, names):
+        # Called by the scheduler for a job it hands to the senders, so jobs
+        # submitted but not started yet count against the domain.
+        with self._changed:
+            for name in names:
+                self._get(name).reserved += 1
+
+    def acquire(self, names):
+        # Blocks a sending thread until every domain of its transaction has
+        # a free slot and a token, then takes them all at once.
+        with self._changed:
+            for name in names:
+                domain = self._get(name)
+                domain.reserved = max(0, domain.reserved - 1)
+            while True:
+                now = time.monotonic()
+                delay = self._delay(names, now, reserved=False)
+                if delay == 0:
+                    break
+                self._changed.wait(1.0 if delay is None else min(delay, 1.0))
+            for name in names:
+                domain = self._get(name)
+                domain.active += 1
+                if self.rate is not None:
+                    domain.tokens -= 1
+
+    def release(self, names):
+        with self._changed:
+            for name in names:
+                self._get(name).active -= 1
+            self._changed.notify_all()
+
+    def on_success(self, names):
+        # One name per recipient delivered.
+        with self._changed:
+            for name in names:
+                domain = self._get(name)
+                domain.strikes = 0
+                domain.sent += 1
+
+    def on_throttle(self, names):
+        # Same backoff as rate_limit.AdaptiveRateLimiter, for these domains
+        # only: an exponentially growing pause while they keep refusing.
+        with self._changed:
+            now = time.monotonic()
+            for name in names:
+                domain = self._get(name)
+                domain.throttles += 1
+                if now >= domain.paused_until:
+                    domain.strikes += 1
+                pause = min(MAX_DOMAIN_COOLDOWN, self.cooldown * 2 ** (domain.strikes - 1))
+                domain.paused_until = max(domain.paused_until, now + pause)
+            self._changed.notify_all()
+
+    def wait(self, timeout):
+        # Wakes the scheduler when a transaction finishes or a domain backs off.
+        with self._changed:
+            self._changed.wait(timeout)
+
+    @property
+    def throttles(self):
+        with self._changed:
+            return sum(domain.throttles for domain in self._domains.values())
+
+    def report(self):
+        # Per-domain counters, busiest domains first.
+        with self._changed:
+            now = time.monotonic()
+            rows = [{'domain': name, 'sent': domain.sent, 'throttles': domain.throttles,
+                     'paused': max(0.0, domain.paused_until - now)}
+                    for name, domain in self._domains.items()]
+        return sorted(rows, key=lambda row: row['sent'], reverse=True)
+
+
+def interleave(jobs, limiter, window=DEFAULT_WINDOW):
+    # Reorders send jobs (index, recipient, message) round-robin by
+    # recipient domain. Up to `window` jobs are read ahead; the next job
+    # comes from the next domain that has room under the limiter, so a
+    # domain at its cap or backing off does not hold up the others.
+    queues = OrderedDict()
+    buffered = 0
+    jobs = iter(jobs)
+    exhausted = False
+    while True:
+        while not exhausted and buffered < window:
+            try:
+                job = next(jobs)
+            except StopIteration:
+                exhausted = True
+                break
+            key = tuple(job_domains(job[1]))
+            queues.setdefault(key, deque()).append(job)
+            buffered += 1
+        if not buffered:
+            return
+        while True:
+            key = next((key for key in queues if limiter.ready(key)), None)
+            if key is not None:
+                break
+            limiter.wait(1.0)
+        queue = queues.pop(key)
+        job = queue.popleft()
+        if queue:
+            # Back of the line, behind the other domains
+            queues[key] = queue
+        buffered -= 1
+        limiter.reserve(key)
+        yield job
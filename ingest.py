@@ -0,0 +1,364 @@
+import hashlib
+import os
+import tempfile
+
+# Chunked reading and validation of recipient files. Everything here yields
+# DataFrames of at most `chunksize` rows, so memory stays bounded no matter
+# how large the upload is. pandas is imported lazily.
+#
+# Given the file's content digest, an upload is converted once into a
+# Parquet file under CACHE_DIR and later reads (previews, validation, every
+# send or rerun) come from there, projected to the columns asked for. The
+# cache keeps each cell as the text pandas would render it, with empty
+# cells as nulls, so messages and row keys are the same either way. Without
+# pyarrow, or with MAIL_INGEST_CACHE set to an empty string, files are read
+# directly.
+
+DEFAULT_CHUNKSIZE = 5000
+PREVIEW_ROWS = 7
+SUPPORTED_EXTENSIONS = ('.csv', '.tsv', '.xlsx', '.xls')
+CACHE_DIR = os.environ.get(
+    "MAIL_INGEST_CACHE",
+    os.path.join(os.path.expanduser("~"), ".mailautomation", "ingest"),
+)
+CACHE_BYTES = 1 << 30
+CACHE_SUFFIX = '.parquet'
+
+
+EMAIL_COLUMN_NAMES = (
+    'mail', 'gmail', 'email', 'g-mail', 'e-mail', 'e mail', 'email address', 'e-mail address', 'g mail',
+    'recipient', 'to', 'receiver', 'user', 'address',
+)
+
+
+class UnsupportedFileError(ValueError):
+    pass
+
+
+def file_kind(name):
+    extension = os.path.splitext(name.lower())[1]
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise UnsupportedFileError(f"Unsupported file format: {name}")
+    return extension.lstrip('.')
+
+
+def detect_email_column(columns):
+    # First column with a well-known email header, else the first column.
+    for column in columns:
+        if str(column).strip().lower() in EMAIL_COLUMN_NAMES:
+            return column
+    return columns[0] if columns else None
+
+
+def _rewind(source):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return source
+
+
+def content_digest(source, blocksize=1 << 20):
+    # sha256 of a path or binary file object, read in blocks.
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(blocksize), b''):
+                digest.update(block)
+    else:
+        _rewind(source)
+        for block in iter(lambda: source.read(blocksize), b''):
+            digest.update(block)
+        _rewind(source)
+    return digest.hexdigest()
+
+
+def _header_names(header):
+    # Column names as pandas gives them: blanks become "Unnamed: i" and
+    # repeated names get a ".1", ".2", ... suffix.
+    header = list(header)
+    while header and header[-1] is None:
+        header.pop()
+    names = []
+    seen = {}
+    for position, value in enumerate(header):
+        name = f"Unnamed: {position}" if value is None else value
+        if isinstance(name, float) and name.is_integer():
+            name = int(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _cell(value):
+    # Whole-number floats become ints, as in pandas' openpyxl reader.
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _iter_xlsx(source, chunksize, columns=None):
+    # openpyxl in read-only mode streams the sheet row by row instead of
+    # loading the workbook, and only the wanted columns are kept. As in
+    # read_excel, blank rows between data rows are kept as empty rows (so
+    # row keys are the same) and only blank rows at the end are dropped.
+    import numpy as np
+    import openpyxl
+    import pandas as pd
+
+    workbook = openpyxl.load_workbook(_rewind(source), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        names = _header_names(next(rows, ()))
+        if columns is None:
+            columns = names
+        missing = [column for column in columns if column not in names]
+        if missing:
+            raise ValueError(f"Usecols do not match columns, columns expected but not found: {missing}")
+        positions = [names.index(column) for column in columns]
+        start = 0
+        batch = []
+        blanks = 0
+        blank = [None] * len(columns)
+        for row in rows:
+            if all(value is None or value == '' for value in row):
+                blanks += 1
+                continue
+            values = [_cell(row[position]) if position < len(row) else None for position in positions]
+            for values in [blank] * blanks + [values]:
+                batch.append(values)
+                if len(batch) == chunksize:
+                    frame = pd.DataFrame(batch, columns=columns, index=pd.RangeIndex(start, start + len(batch)))
+                    yield frame.fillna(np.nan)
+                    start += len(batch)
+                    batch = []
+            blanks = 0
+        if batch:
+            frame = pd.DataFrame(batch, columns=columns, index=pd.RangeIndex(start, start + len(batch)))
+            yield frame.fillna(np.nan)
+    finally:
+        workbook.close()
+
+
+def _iter_source(source, name, chunksize, columns=None):
+    import pandas as pd
+
+    kind = file_kind(name)
+    if kind in ('csv', 'tsv'):
+        sep = '\t' if kind == 'tsv' else ','
+        with pd.read_csv(_rewind(source), sep=sep, chunksize=chunksize, usecols=columns) as reader:
+            for chunk in reader:
+                yield chunk[columns] if columns is not None else chunk
+    elif kind == 'xlsx':
+        yield from _iter_xlsx(source, chunksize, columns)
+    else:
+        # Legacy .xls cannot be streamed; read once and hand out slices so
+        # callers see the same interface.
+        frame = pd.read_excel(_rewind(source), usecols=columns)
+        if columns is not None:
+            frame = frame[columns]
+        for start in range(0, len(frame), chunksize):
+            yield frame.iloc[start:start + chunksize]
+
+
+def _as_text(chunk):
+    # Each cell as the text a rendered template would show; empty cells stay
+    # null so dropna and notna behave as on the original frame.
+    import pandas as pd
+
+    return pd.DataFrame({str(column): chunk[column].astype(str).where(chunk[column].notna(), None)
+                         for column in chunk.columns})
+
+
+def cached_table(source, name, digest, directory=None):
+    # Path of the Parquet copy of this upload, converting it on first use.
+    # None when the cache is disabled or unavailable.
+    directory = CACHE_DIR if directory is None else directory
+    if not directory:
+        return None
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+    # The same bytes parse differently as .csv and as .tsv, so the kind is
+    # part of the key.
+    path = os.path.join(directory, f"{digest}.{file_kind(name)}{CACHE_SUFFIX}")
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+    except OSError:
+        return None
+    writer = None
+    try:
+        for chunk in _iter_source(source, name, DEFAULT_CHUNKSIZE):
+            frame = _as_text(chunk)
+            if writer is None:
+                schema = pa.schema([(column, pa.string()) for column in frame.columns])
+                writer = pq.ParquetWriter(partial, schema)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+        if writer is None:
+            # Nothing but a header: not worth caching
+            os.remove(partial)
+            return None
+        writer.close()
+        os.replace(partial, path)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    _evict_cache(directory, keep=path)
+    return path
+
+
+def _evict_cache(directory, keep, max_bytes=CACHE_BYTES):
+    # Drop the least recently used conversions once over max_bytes.
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(CACHE_SUFFIX) and entry.path != keep:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _open_cached(path, columns=None):
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(path)
+    if columns is not None:
+        missing = [column for column in columns if column not in parquet.schema_arrow.names]
+        if missing:
+            raise ValueError(f"Usecols do not match columns, columns expected but not found: {missing}")
+    return parquet
+
+
+def _iter_cached(path, chunksize, columns=None):
+    import numpy as np
+    import pandas as pd
+
+    parquet = _open_cached(path, columns)
+    start = 0
+    for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+        frame = batch.to_pandas()
+        frame.index = pd.RangeIndex(start, start + len(frame))
+        start += len(frame)
+        yield frame.fillna(np.nan)
+
+
+def iter_chunks(source, name, chunksize=DEFAULT_CHUNKSIZE, columns=None, digest=None):
+    # source is a path or a binary file object (e.g. a Streamlit upload).
+    # columns limits the read to those columns, in that order; digest
+    # (content_digest of source) reads through the columnar cache.
+    path = cached_table(source, name, digest) if digest is not None else None
+    if path is not None:
+        yield from _iter_cached(path, chunksize, columns)
+    else:
+        yield from _iter_source(source, name, chunksize, columns)
+
+
+def read_preview(source, name, rows=PREVIEW_ROWS, digest=None):
+    for chunk in iter_chunks(source, name, chunksize=max(rows, 1), digest=digest):
+        return chunk
+    import pandas as pd
+    return pd.DataFrame()
+
+
+def _read_cached_rows(path, start, stop, columns=None):
+    # Only the row groups overlapping [start, stop) are read.
+    import numpy as np
+    import pandas as pd
+
+    parquet = _open_cached(path, columns)
+    groups = []
+    first = offset = 0
+    for group in range(parquet.num_row_groups):
+        rows = parquet.metadata.row_group(group).num_rows
+        if offset < stop and offset + rows > start:
+            if not groups:
+                first = offset
+            groups.append(group)
+        offset += rows
+    if not groups:
+        return pd.DataFrame(columns=columns or parquet.schema_arrow.names)
+    frame = parquet.read_row_groups(groups, columns=columns).to_pandas()
+    frame.index = pd.RangeIndex(first, first + len(frame))
+    return frame.iloc[start - first:stop - first].fillna(np.nan)
+
+
+def read_rows(source, name, start, stop, columns=None, digest=None):
+    # Rows start..stop-1 of the file, with their row keys, e.g. for a page
+    # of previews. From the cache this reads a row group or two; otherwise
+    # the file is streamed up to stop.
+    import pandas as pd
+
+    path = cached_table(source, name, digest) if digest is not None else None
+    if path is not None:
+        return _read_cached_rows(path, start, stop, columns)
+    parts = []
+    offset = 0
+    for chunk in _iter_source(source, name, DEFAULT_CHUNKSIZE, columns):
+        if offset + len(chunk) > start:
+            parts.append(chunk.iloc[max(0, start - offset):stop - offset])
+        offset += len(chunk)
+        if offset >= stop:
+            break
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts)
+
+
+def read_columns(source, name, digest=None):
+    return read_preview(source, name, rows=1, digest=digest).columns.tolist()
+
+
+def _validator(source, name, emailcolumn, chunksize, digest, validator):
+    # A fresh default validation.RecipientValidator unless one is given;
+    # keeping the last duplicate takes a first pass over the email column.
+    from validation import KEEP_LAST, RecipientValidator
+
+    if validator is None:
+        validator = RecipientValidator(emailcolumn)
+    if validator.keep == KEEP_LAST:
+        validator.prescan(iter_chunks(source, name, chunksize, [emailcolumn], digest))
+    return validator
+
+
+def iter_valid_chunks(source, name, emailcolumn, chunksize=DEFAULT_CHUNKSIZE, columns=None, digest=None,
+                      validator=None):
+    # Rows to send, with the email column normalized. A validator is good
+    # for one pass; pass a new one with the same settings each time.
+    validator = _validator(source, name, emailcolumn, chunksize, digest, validator)
+    for chunk in iter_chunks(source, name, chunksize, columns, digest):
+        chunk = validator.apply(chunk)
+        if len(chunk):
+            yield chunk
+
+
+def count_rows(source, name, emailcolumn, chunksize=DEFAULT_CHUNKSIZE, digest=None, validator=None):
+    # One streaming pass over the email column: (total rows, rows to send).
+    # The validator given keeps the rejected rows for a report.
+    validator = _validator(source, name, emailcolumn, chunksize, digest, validator)
+    total = 0
+    for chunk in iter_chunks(source, name, chunksize, [emailcolumn], digest):
+        total += len(chunk)
+        validator.apply(chunk)
+    return total, validator.valid
@@ -0,0 +1,176 @@
+import itertools
+import threading
+import time
+from collections import deque
+from queue import Queue
+
+# Background send jobs. A JobManager owns one worker thread that runs queued
+# jobs in order; the UI only reads the shared progress fields and flips the
+# pause/cancel flags, so the Streamlit script thread is never blocked.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+DONE = 'done'
+FAILED = 'failed'
+
+FINISHED_STATES = (CANCELLED, DONE, FAILED)
+MAX_ERRORS = 50
+MAX_FINISHED_JOBS = 20
+
+
+class SendJob:
+    def __init__(self, job_id, name, run, total=0, owner=None, on_finish=None):
+        # owner: whoever submitted the job (a sender login); only they get
+        # to see and control it. on_finish() runs once the job is over,
+        # also when it was cancelled before it started.
+        self.id = job_id
+        self.name = name
+        self.total = total
+        self.owner = owner
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.errors = deque(maxlen=MAX_ERRORS)
+        self.error = ''
+        self.info = {}
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._run = run
+        self._on_finish = on_finish
+        self._state = QUEUED
+        self._lock = threading.Lock()
+        self._resume = threading.Event()
+        self._resume.set()
+        self._cancel = threading.Event()
+
+    @property
+    def state(self):
+        if self._state == RUNNING and not self._resume.is_set():
+            return PAUSED
+        return self._state
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def pause(self):
+        self._resume.clear()
+
+    def resume(self):
+        self._resume.set()
+
+    def cancel(self):
+        self._cancel.set()
+        self._resume.set()
+
+    def checkpoint(self, block=True):
+        # Called by the sender between messages: blocks while paused and
+        # returns False once the job has been cancelled. With block=False a
+        # paused job returns None at once, so the sender can first collect
+        # the messages it still has in flight.
+        if not block and not self._resume.is_set() and not self._cancel.is_set():
+            return None
+        while not self._resume.wait(timeout=0.5):
+            if self._cancel.is_set():
+                return False
+        return not self._cancel.is_set()
+
+    def record(self, result):
+        with self._lock:
+            if result.ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+                self.errors.append((result.recipient, result.error))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'name': self.name,
+                'state': self.state,
+                'total': self.total,
+                'sent': self.sent,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'errors': list(self.errors),
+                'error': self.error,
+                'elapsed': self.elapsed,
+                'info': dict(self.info),
+            }
+
+    def _execute(self):
+        try:
+            if self._cancel.is_set():
+                self._state = CANCELLED
+                return
+            self._state = RUNNING
+            self.started = time.time()
+            try:
+                self._run(self)
+                self._state = CANCELLED if self._cancel.is_set() else DONE
+            except Exception as e:
+                self.error = str(e)
+                self._state = FAILED
+            finally:
+                self.finished = time.time()
+        finally:
+            if self._on_finish is not None:
+                self._on_finish()
+
+
+class JobManager:
+    def __init__(self):
+        self._jobs = {}
+        self._queue = Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._work, name='send-jobs', daemon=True)
+        self._worker.start()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job._execute()
+
+    def submit(self, name, run, total=0, owner=None, on_finish=None):
+        # run(job) does the sending and reports through the job object.
+        with self._lock:
+            job = SendJob(next(self._ids), name, run, total, owner, on_finish)
+            self._jobs[job.id] = job
+            self._prune()
+        self._queue.put(job)
+        return job
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.state in FINISHED_STATES]
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self, owner=None):
+        # Every job, or only those submitted by owner.
+        with self._lock:
+            return sorted((job for job in self._jobs.values() if owner is None or job.owner == owner),
+                          key=lambda job: job.id)
+
+    def clear_finished(self, owner=None):
+        with self._lock:
+            for job in [job for job in self._jobs.values()
+                        if job.state in FINISHED_STATES and (owner is None or job.owner == owner)]:
+                del self._jobs[job.id]
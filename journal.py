@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Append-only send journal. Every state change of every recipient is
+# recorded as a new row, keyed by campaign and recipient, so an interrupted
+# run can be resumed by skipping the rows that already reached "sent".
+
+QUEUED = 'queued'
+SENT = 'sent'
+FAILED = 'failed'
+
+DEFAULT_PATH = os.environ.get(
+    "MAIL_JOURNAL",
+    os.path.join(os.path.expanduser("~"), ".mailautomation", "journal.sqlite3"),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign TEXT NOT NULL,
+    row_key TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT NOT NULL DEFAULT '',
+    ts REAL NOT NULL,
+    account TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS events_campaign_row ON events (campaign, row_key);
+CREATE INDEX IF NOT EXISTS events_state_ts ON events (state, ts);
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign TEXT PRIMARY KEY,
+    sender TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+def campaign_id(sender_email, subject, message_template, memo, emailcolumn, recipients_digest):
+    # Same sender, content, mapping and recipient file -> same campaign.
+    # recipients_digest is ingest.content_digest() of the recipient file.
+    key = json.dumps([sender_email, subject, message_template, memo, emailcolumn, recipients_digest],
+                     sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+class SendJournal:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Journals written before multi-account sending lack the account column
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(events)")]
+        if 'account' not in columns:
+            self._conn.execute("ALTER TABLE events ADD COLUMN account TEXT NOT NULL DEFAULT ''")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def register(self, campaign, sender_email):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO campaigns (campaign, sender, created) VALUES (?, ?, ?)",
+                (campaign, sender_email or '', time.time()),
+            )
+
+    def _append(self, campaign, rows, account=''):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO events (campaign, row_key, recipient, state, error, ts, account) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(campaign, str(row_key), str(recipient), state, error, now, account or '')
+                 for row_key, recipient, state, error in rows],
+            )
+
+    def mark_queued(self, campaign, recipients):
+        # recipients yields (row_key, recipient); written in one transaction.
+        self._append(campaign, [(row_key, recipient, QUEUED, '') for row_key, recipient in recipients])
+
+    def mark_sent(self, campaign, row_key, recipient, account=''):
+        self._append(campaign, [(row_key, recipient, SENT, '')], account)
+
+    def mark_failed(self, campaign, row_key, recipient, error='', account=''):
+        self._append(campaign, [(row_key, recipient, FAILED, str(error))], account)
+
+    def record(self, campaign, result):
+        # Convenience for send_engine.SendResult objects.
+        if result.ok:
+            self.mark_sent(campaign, result.index, result.recipient, result.account)
+        else:
+            self.mark_failed(campaign, result.index, result.recipient, result.error, result.account)
+
+    def completed(self, campaign):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT row_key FROM events WHERE campaign = ? AND state = ?",
+                (campaign, SENT),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def summary(self, campaign):
+        # Latest state per recipient, counted.
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT state, COUNT(*) FROM (
+                    SELECT e.state FROM events e
+                    JOIN (SELECT row_key, MAX(id) AS last FROM events WHERE campaign = ? GROUP BY row_key) l
+                      ON e.id = l.last
+                ) GROUP BY state
+                """,
+                (campaign,),
+            ).fetchall()
+        counts = {QUEUED: 0, SENT: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def sent_since(self, since, sender_email=None):
+        # Sends recorded after `since` (epoch seconds), optionally for one
+        # sending account. Events without an account count for the
+        # campaign's sender.
+        query = "SELECT COUNT(*) FROM events e WHERE e.state = ? AND e.ts >= ?"
+        params = [SENT, since]
+        if sender_email is not None:
+            query += (" AND (e.account = ? OR (e.account = ''"
+                      " AND e.campaign IN (SELECT campaign FROM campaigns WHERE sender = ?)))")
+            params.extend([sender_email, sender_email])
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def sent_last_day(self, sender_email=None):
+        return self.sent_since(time.time() - 24 * 60 * 60, sender_email)
@@ -1,7 +1,18 @@
-import smtplib
 import streamlit as st
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from metrics import SendMetrics
+from metrics_view import show_send_metrics
+from send_engine import SendResult
+from session_cache import SessionCache
+
+
+@st.cache_resource
+def smtp_sessions():
+    # Logged-in connections shared by every session and rerun of this
+    # server process, so repeat sends skip the connect and login
+    return SessionCache()
+
 
 def send_gmail_message():
     # Load CSS
@@ -44,17 +55,21 @@ def send_gmail_message():
 
     if st.button("📤 Send GMail Message", type="primary"):
         if recipient_email and subject and message and sender_email and sender_password:
+            metrics = SendMetrics()
             try:
-                msg = MIMEMultipart()
-                msg['From'] = sender_email
-                msg['To'] = recipient_email
-                msg['Subject'] = subject
-                msg.attach(MIMEText(message, 'plain'))
-                server = smtplib.SMTP('smtp.gmail.com', 587)
-                server.starttls()
-                server.login(sender_email, sender_password)
-                server.sendmail(sender_email, recipient_email, msg.as_string())
-                server.quit()
+                with metrics.timer('serialize'):
+                    msg = MIMEMultipart()
+                    msg['From'] = sender_email
+                    msg['To'] = recipient_email
+                    msg['Subject'] = subject
+                    msg.attach(MIMEText(message, 'plain'))
+                    payload = msg.as_string()
+                with metrics.timer('smtp_send'):
+                    smtp_sessions().send(sender_email, sender_password, recipient_email, payload, metrics=metrics)
+                metrics.record(SendResult(0, recipient_email, True, elapsed=metrics.elapsed))
+                metrics.finish()
+                # Kept in the session so the export buttons survive their own rerun
+                st.session_state["single_send_metrics"] = metrics
                 st.success(f"✅ Email sent to {recipient_email} with subject '{subject}'.")
             except Exception as e:
                 st.error(f"❌ Error: {e}")
@@ -64,3 +79,6 @@ def send_gmail_message():
                 st.write("- Check if 'Less secure app access' is enabled (not recommended)")
         else:
             st.error("⚠️ Please fill in all fields.")
+
+    if "single_send_metrics" in st.session_state:
+        show_send_metrics(st.session_state["single_send_metrics"], key="single")
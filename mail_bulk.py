@@ -1,11 +1,181 @@
-import smtplib
 import streamlit as st
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
-import pandas as pd
-import time
+import io
+import os
+import sqlite3
+import hashlib
+from ingest import PREVIEW_ROWS, UnsupportedFileError, content_digest, detect_email_column, read_preview, read_rows, count_rows, iter_valid_chunks
+from quota import SendQuota, DEFAULT_PER_RUN, DEFAULT_PER_DAY
+from accounts import Account, AccountPool
+from domains import DomainLimiter, DEFAULT_PER_DOMAIN
+from validation import KEEP_POLICIES, REASONS as REJECT_REASONS, RecipientValidator, load_suppression
+from journal import SendJournal, campaign_id
+from message_builder import MessageBuilder
+from attachments import AttachmentCache, release as release_attachments
+from template import TemplateIndex, check_mapping
+from rate_limit import AdaptiveRateLimiter, DEFAULT_RATE, MIN_RATE
+from campaign import Campaign, DEFAULT_FANOUT, MAX_FANOUT, needed_columns
+from recipients import RecipientBatch
+from send_engine import SendEngine, DEFAULT_CONNECTIONS, MAX_CONNECTIONS
+from metrics import SendMetrics
+from metrics_view import show_send_metrics
+from spool import FORMATS as SPOOL_FORMATS, create_spool
+from jobs import JobManager, FINISHED_STATES, QUEUED as JOB_QUEUED, RUNNING as JOB_RUNNING, PAUSED as JOB_PAUSED, DONE as JOB_DONE, FAILED as JOB_FAILED
+
+UPLOAD_CACHE_ENTRIES = 8
+MAX_REJECTED_SHOWN = 1000
+PREVIEW_PAGE_ROWS = 10
+JOB_POLL_SECONDS = 2
+MAX_RENDER_WORKERS = os.cpu_count() or 1
+MAX_EXTRA_ACCOUNTS = 10
+SPOOL_DIR = os.path.join(os.path.expanduser("~"), ".mailautomation", "spool")
+UPLOAD_CACHE_TTL = 60 * 60
+
+
+def upload_digest(upload):
+    # Hash each upload once; reruns reuse the digest stored for its file_id.
+    digests = st.session_state.setdefault("upload_digests", {})
+    if upload.file_id not in digests:
+        digests.clear()
+        digests[upload.file_id] = content_digest(upload)
+    return digests[upload.file_id]
+
+
+# Parsed uploads are cached by content hash and options, so widget
+# interactions no longer re-read the file. Arguments starting with an
+# underscore are not hashed by Streamlit.
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL, show_spinner=False)
+def cached_preview(digest, name, _upload):
+    return read_preview(_upload, name, digest=digest)
+
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL, show_spinner="Validating recipients...")
+def cached_validation(digest, name, emailcolumn, keep, suppression_digest, _suppressed, _upload):
+    # suppression_digest stands in for the unhashed suppression list
+    validator = RecipientValidator(emailcolumn, keep, _suppressed)
+    total_rows, valid_count = count_rows(_upload, name, emailcolumn, digest=digest, validator=validator)
+    first_rows = next(iter_valid_chunks(_upload, name, emailcolumn, chunksize=PREVIEW_ROWS, digest=digest,
+                                        validator=RecipientValidator(emailcolumn, keep, _suppressed)), None)
+    return total_rows, valid_count, first_rows, validator.report(), validator.rejected
+
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL, show_spinner=False)
+def cached_suppression(digest, _upload):
+    return load_suppression(io.BytesIO(_upload.getvalue()))
+
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES * 4, show_spinner=False)
+def cached_index(text):
+    return TemplateIndex(text or '')
+
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES * 4, ttl=UPLOAD_CACHE_TTL, show_spinner=False)
+def cached_page(digest, name, start, stop, columns, _upload):
+    return read_rows(_upload, name, start, stop, list(columns), digest=digest)
+
+
+def cache_attachments(uploads):
+    # Attachments are encoded once into the on-disk cache and streamed from
+    # there while sending; kept in memory only if the cache is unavailable.
+    # Cached parts are pinned until release_attachments(), so later uploads
+    # cannot evict them while a job still has to send them.
+    try:
+        cache = AttachmentCache()
+    except OSError:
+        cache = None
+    attachments = []
+    for upload in uploads or ():
+        upload.seek(0)
+        if cache is not None:
+            attachments.append(cache.add(upload.name, upload, pin=True))
+        else:
+            attachments.append((upload.name, upload.getvalue()))
+    return attachments
+
+
+@st.cache_resource
+def job_manager():
+    # One manager per server process, shared by every session and rerun
+    return JobManager()
+
+
+def job_owner(sender_email, sender_password):
+    # Jobs belong to the Gmail login that queued them, not to the browser
+    # session: signing in again after a reload or from another tab finds
+    # them, anyone else neither sees their recipients nor can pause or
+    # cancel them. None until an address is entered.
+    if not sender_email:
+        return None
+    login = f"{sender_email.strip().lower()}\0{sender_password or ''}"
+    return hashlib.sha256(login.encode("utf-8")).hexdigest()
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_send_jobs(owner):
+    # Polls the shared job objects every few seconds instead of pushing an
+    # update for every single email
+    if owner is None:
+        return
+    manager = job_manager()
+    jobs = manager.jobs(owner)
+    if not jobs:
+        return
+    st.subheader("📬 Send Jobs")
+    for job in reversed(jobs):
+        snap = job.snapshot()
+        info = snap["info"]
+        total = snap["total"] or 1
+        done = snap["sent"] + snap["failed"]
+        with st.container(border=True):
+            st.markdown(f"**#{snap['id']} · {snap['name']}** — `{snap['state']}`")
+            if info.get("phase") in ("spooling", "spooled"):
+                st.progress(min(done / total, 1.0), text=f"🧪 {snap['sent']} written to the spool • {snap['elapsed']:.0f}s")
+            else:
+                st.progress(min(done / total, 1.0),
+                            text=f"✅ {snap['sent']} sent • ❌ {snap['failed']} failed • ⏭️ {snap['skipped']} skipped • {snap['elapsed']:.0f}s")
+            if snap["state"] == JOB_RUNNING:
+                col1, col2 = st.columns(2)
+                col1.button("⏸️ Pause", key=f"pause_{job.id}", on_click=job.pause)
+                col2.button("⏹️ Cancel", key=f"cancel_{job.id}", on_click=job.cancel)
+            elif snap["state"] == JOB_PAUSED:
+                col1, col2 = st.columns(2)
+                col1.button("▶️ Resume", key=f"resume_{job.id}", on_click=job.resume)
+                col2.button("⏹️ Cancel", key=f"cancel_{job.id}", on_click=job.cancel)
+            elif snap["state"] == JOB_QUEUED:
+                st.button("⏹️ Cancel", key=f"cancel_{job.id}", on_click=job.cancel)
+            elif snap["state"] == JOB_FAILED:
+                st.error(f"❌ Send job failed: {snap['error']}")
+                st.write("💡 **Troubleshooting tips:**")
+                st.write("- Make sure you're using an App Password, not your regular Gmail password")
+                st.write("- Enable 2-factor authentication and generate an App Password")
+                st.write("- Check if 'Less secure app access' is enabled (not recommended)")
+            elif snap["state"] == JOB_DONE and info.get("phase") == "spooled":
+                st.info(f"🧪 **Dry run complete:** {snap['sent']} emails written to `{info['spool']}` in {snap['elapsed']:.2f} seconds.\n\n"
+                        f"Send them later with `python cli.py --drain {info['spool']}`.")
+            elif snap["state"] == JOB_DONE and info.get("phase") == "finished":
+                st.info(f"📊 **Results Summary:**\n"
+                       f"- Total emails attempted: {done}\n"
+                       f"- Successfully sent: {snap['sent']}\n"
+                       f"- Errors: {snap['failed']}\n"
+                       f"- Skipped (already sent): {snap['skipped']}\n"
+                       f"- Left for a later run (sending limit): {info.get('deferred', 0)}\n"
+                       f"- Throttled by Gmail: {info.get('throttles', 0)} time(s), final rate {info.get('final_rate', 0):.1f} emails/second\n"
+                       f"- Time taken: {snap['elapsed']:.2f} seconds")
+            if info.get("accounts") is not None:
+                st.dataframe(info["accounts"].report(), hide_index=True,
+                             column_order=("account", "state", "sent", "failed", "moved_away",
+                                           "emails_per_second", "throttles", "remaining_today", "reason"))
+            if info.get("domains") is not None:
+                with st.expander("🌐 Recipient domains", expanded=False):
+                    st.dataframe(info["domains"].report(), hide_index=True)
+            if info.get("metrics") is not None:
+                show_send_metrics(info["metrics"], key=f"job_{job.id}", labels={"job": job.id})
+            if snap["errors"]:
+                with st.expander(f"❌ Failed recipients ({snap['failed']})", expanded=False):
+                    for recipient, error in snap["errors"]:
+                        st.write(f"- {recipient}: {error}")
+    if any(job.state in FINISHED_STATES for job in jobs):
+        st.button("🧹 Clear finished jobs", on_click=manager.clear_finished, args=(owner,))
+
 
 def send_gmail_bulk_message():
     # Load CSS
@@ -32,7 +202,7 @@ def send_gmail_bulk_message():
     with st.expander("ℹ️ Complete Guide - How to use Gmail Bulk Message Sender", expanded=False):
         st.markdown("""
         ## 🚀 Features
-        - Send personalized emails to multiple recipients (up to 500 at once)
+        - Send personalized emails to multiple recipients (large files are streamed in chunks)
         - Support for CSV, XLSX, XLS, and TSV file uploads
         - Advanced email templating with personalization variables
         - Subject line personalization with dynamic content
@@ -46,7 +216,7 @@ def send_gmail_bulk_message():
         **CSV/Excel File Requirements:**
         - Must contain an email column (automatically detected)
         - Additional columns for personalization (name, company, date, etc.)
-        - Maximum 500 rows for bulk sending
+        - No row limit: large files are read in chunks; a per-run and daily sending limit applies
         - Supported formats: CSV, XLSX, XLS, TSV
         
         **Template File (.txt):**
@@ -129,6 +299,10 @@ def send_gmail_bulk_message():
                                       help="Use a Gmail App Password for better security. Do not use your regular password.")    
     if not sender_email or not sender_password:
         st.error("⚠️ Please enter valid Gmail credentials to proceed")
+    
+    # Progress of this login's queued and running campaigns, refreshed on
+    # its own timer
+    show_send_jobs(job_owner(sender_email, sender_password))
         
     # File upload section
     st.markdown("---")
@@ -141,7 +315,7 @@ def send_gmail_bulk_message():
         - **Must have:** Email column (will be auto-detected)
         - **Can have:** Any additional columns for personalization
         - **Formats:** CSV, XLSX, XLS, TSV
-        - **Limit:** Maximum 500 rows
+        - **Limit:** None on file size; sending is capped by the per-run and daily limits (500 by default)
         
         ### Template File Requirements:
         - **Format:** Plain text (.txt) file only
@@ -198,45 +372,62 @@ def send_gmail_bulk_message():
     errorcount = 0
       # CSV file processing and column mapping
     if file is not None:
-        if file.name.endswith('.csv'):
-            filedata = pd.read_csv(file)
-        elif file.name.endswith('.tsv'):
-            filedata = pd.read_csv(file, sep='\t')
-        elif file.name.endswith('.xlsx') or file.name.endswith('.xls'):
-            filedata = pd.read_excel(file)
-        else:
+        digest = upload_digest(file)
+        try:
+            preview = cached_preview(digest, file.name, file)
+        except UnsupportedFileError:
             st.error("Unsupported file format. Please upload a CSV, TSV, XLS, or XLSX file.")
             return
             
         st.markdown("---")
         st.subheader("📊 Step 4: Data Preview & Configuration")
-        st.success(f"✅ Successfully loaded {len(filedata)} rows from your file!")
+        st.success("✅ Successfully opened your file!")
         
         with st.expander("📋 View Your Data (First 7 rows)", expanded=False):
-            st.dataframe(filedata.head(7))
+            st.dataframe(preview)
             
-        st.info(f"📈 **Data Summary:** {len(filedata)} total rows • {len(filedata.columns)} columns detected")
-        
-        columns = filedata.columns.tolist()
+        columns = preview.columns.tolist()
         memo = {}
         
         # Email column selection
         st.markdown("### 📧 Email Column Selection")
-        emailcolumnopts = [
-            'mail', 'gmail', 'email', 'g-mail', 'e-mail', 'e mail', 'email Address', 'e-mail Address', 'g mail',
-            'recipient', 'to', 'receiver','user', 'address', 
-        ]
-        for a in columns:
-            if a.lower() in emailcolumnopts:
-                emailcolumn = a
-                break
-         # Default to first column if no email column found
+        emailcolumn = detect_email_column(columns)
             
         emailcolumn = st.selectbox("Select the column containing email addresses", 
                                  options=columns, 
                                  index=columns.index(emailcolumn), 
                                  help="Choose the column from your uploaded file that contains the recipient email addresses.")
         
+        col1, col2 = st.columns(2)
+        with col1:
+            keep = st.selectbox("Duplicate addresses", KEEP_POLICIES,
+                                format_func=lambda policy: {"first": "Send to the first row only",
+                                                            "last": "Send to the last row only",
+                                                            "all": "Send to every row"}[policy],
+                                help="What to do when the same address appears on several rows.")
+        with col2:
+            suppression = st.file_uploader("🚫 Suppression list (optional)", type=["txt", "csv"],
+                                           help="Addresses that must not be emailed, one per line. A line like @example.com skips the whole domain.")
+        suppressed = None
+        suppression_digest = None
+        if suppression is not None:
+            suppression_digest = content_digest(suppression)
+            suppressed = cached_suppression(suppression_digest, suppression)
+        
+        # Stream through the file once to validate every row without holding it in memory
+        total_rows, valid_count, filedata, validation, rejected = cached_validation(
+            digest, file.name, emailcolumn, keep, suppression_digest, suppressed, file)
+        st.info(f"📈 **Data Summary:** {total_rows} total rows • {len(columns)} columns detected")
+        if len(rejected):
+            reasons = " • ".join(f"{validation[reason]} {reason}" for reason in REJECT_REASONS if reason in validation)
+            st.warning(f"🧹 **{len(rejected)} row(s) will not be sent:** {reasons}")
+            with st.expander("🔎 Rejected rows", expanded=False):
+                st.dataframe(rejected.head(MAX_REJECTED_SHOWN), use_container_width=True)
+                if len(rejected) > MAX_REJECTED_SHOWN:
+                    st.caption(f"Showing the first {MAX_REJECTED_SHOWN} of {len(rejected)} rejected rows.")
+                st.download_button("⬇️ Download rejected rows (CSV)", rejected.to_csv(index=False).encode("utf-8"),
+                                   file_name="rejected_rows.csv", mime="text/csv")
+        
         st.markdown("---")
         st.subheader("📝 Step 5: Column Mapping for Personalization")
         st.info("🎯 **Map your CSV columns to template variables.** Leave empty for columns you don't want to use.")
@@ -257,12 +448,17 @@ def send_gmail_bulk_message():
             - Flexibility to reuse templates with different CSV formats
             - Skip columns you don't need in emails            """)
         
+        # Sample values are only rendered on request; one dataframe widget per
+        # column is the slowest part of a rerun on wide files
+        show_samples = st.toggle("Show sample values for each column", value=False)
+        
         for i in range(len(columns)):
             col1, col2 = st.columns([2, 3])
             
             with col1:
                 st.markdown(f"**Column:** `{columns[i]}`")
-                st.dataframe(filedata[columns[i]].head(2), use_container_width=True)
+                if show_samples:
+                    st.dataframe(preview[columns[i]].head(2), use_container_width=True)
                 
             with col2:
                 text = st.text_input(f"Template variable name for '{columns[i]}' (leave empty to skip)", 
@@ -274,18 +470,12 @@ def send_gmail_bulk_message():
             if text.strip():
                 memo[columns[i]] = text.strip()
 
-        filedata = filedata.dropna(subset=[emailcolumn])  # Ensure email column exists and is not empty
-        filedata = filedata[filedata[emailcolumn].str.contains('@', na=False)]  # Filter rows with valid email format
-        
         # Data validation
-        if len(filedata) == 0:
+        if valid_count == 0:
             st.error("❌ No valid email addresses found in your file. Please check your data.")
             return
-        elif len(filedata) > 500:
-            st.error("⚠️ The number of valid email rows must be less than 500. Please reduce your data size.")
-            return
         else:
-            st.success(f"✅ Found {len(filedata)} valid email addresses ready for sending!")
+            st.success(f"✅ Found {valid_count} valid email addresses ready for sending!")
             
     else:
         st.error("📁 Please upload a CSV file with recipient emails to continue.")
@@ -298,19 +488,46 @@ def send_gmail_bulk_message():
     if template is not None:
         message_template = template.read().decode('utf-8')
         
+        # Parse template and subject once; a changed mapping only re-binds them
+        body_index = cached_index(message_template)
+        subject_index = cached_index(subject)
+        body_template = body_index.bind(memo)
+        subject_template = subject_index.bind(memo)
+        
+        unknown, unused = check_mapping(memo, subject_index, body_index)
+        if unknown:
+            st.warning(f"⚠️ **Unknown variables:** {', '.join('{' + name + '}' for name in unknown)} "
+                       "match no mapped column and will be sent exactly as typed. Check the spelling or the column mapping in Step 5.")
+        if unused:
+            st.info(f"ℹ️ **Mapped but not used:** {', '.join(unused)}")
+        
         if filedata is not None and len(filedata) > 0:
-            st.info("� **Preview shows how your first email will look.** All emails will be personalized similarly.")
+            st.info("� **Preview any recipient.** Pick a page of rows, then the row to show in full.")
             
-            # Generate preview using first row
-            personalized_message = message_template
-            personalized_subject = subject
-            row = filedata.iloc[0]  
+            # Only the page asked for is read and rendered
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                first = st.number_input("Preview rows starting at row", min_value=0,
+                                        max_value=max(total_rows - 1, 0), value=0, step=PREVIEW_PAGE_ROWS,
+                                        help="Row numbers as in the rejected rows report: the first data row is 0.")
+            page_columns = needed_columns(emailcolumn, subject_template, body_template)
+            page = cached_page(digest, file.name, first, first + PREVIEW_PAGE_ROWS, tuple(page_columns), file)
+            batch = RecipientBatch.from_frame(page, emailcolumn, page_columns)
+            subjects = subject_template.render_batch(batch)
+            bodies = body_template.render_batch(batch)
+            # Only the rejected rows on this page, not a lookup of all of them
+            keys = [str(key) for key in batch.keys]
+            on_page = rejected[rejected["row"].isin(keys)] if len(rejected) else rejected
+            reasons = dict(zip(on_page["row"], on_page["reason"]))
+            statuses = [reasons.get(key, "will be sent") for key in keys]
+            with col2:
+                st.dataframe({"row": batch.keys, "to": batch.emails, "subject": subjects, "status": statuses},
+                             use_container_width=True, hide_index=True)
             
-            if template is not None:
-                for csv_col, template_var in memo.items():
-                    if template_var and csv_col in row:
-                        personalized_message = personalized_message.replace(f'{{{template_var}}}', str(row[csv_col]))
-                        personalized_subject = personalized_subject.replace(f'{{{template_var}}}', str(row[csv_col]))
+            if len(batch):
+                sendable = [position for position, status in enumerate(statuses) if status == "will be sent"]
+                position = st.selectbox("Row to preview", range(len(batch)), index=sendable[0] if sendable else 0,
+                                        format_func=lambda position: f"Row {batch.keys[position]}: {batch.emails[position]}")
                 
                 with st.container():
                     st.markdown("### 📧 Email Preview")
@@ -318,22 +535,24 @@ def send_gmail_bulk_message():
                     
                     with col1:
                         st.markdown("**Email Details:**")
-                        st.write(f"**📧 To:** {row[emailcolumn]}")
-                        st.write(f"**📝 Subject:** {personalized_subject}")
-                        st.write(f"**📊 Total Recipients:** {len(filedata)}")
+                        st.write(f"**📧 To:** {batch.emails[position]}")
+                        st.write(f"**📝 Subject:** {subjects[position]}")
+                        st.write(f"**📊 Total Recipients:** {valid_count}")
+                        if statuses[position] != "will be sent":
+                            st.write(f"**🚫 Not sent:** {statuses[position]}")
                         if uploaddata:
                             st.write(f"**📎 Attachments:** {len(uploaddata)} file(s)")
                     
                     with col2:
                         st.markdown("**Message Content:**")
-                        st.text_area("Preview:", value=personalized_message, height=200, disabled=True)
+                        st.text_area("Preview:", value=bodies[position], height=200, disabled=True)
                         
-                # Variables used summary
-                used_vars = [var for var in memo.values() if var and f'{{{var}}}' in message_template]
-                if used_vars:
-                    st.success(f"🎯 **Template Variables Found:** {', '.join(used_vars)}")
-                else:
-                    st.warning("⚠️ **No template variables detected.** Your emails will be identical for all recipients.")
+            # Variables used summary
+            used_vars = list(dict.fromkeys(subject_template.variables + body_template.variables))
+            if used_vars:
+                st.success(f"🎯 **Template Variables Found:** {', '.join(used_vars)}")
+            else:
+                st.warning("⚠️ **No template variables detected.** Your emails will be identical for all recipients, so they can be sent in batches of blind copies (see Step 7).")
                     
     else:
         st.error("📝 Please upload a template file to continue.")
@@ -351,12 +570,14 @@ def send_gmail_bulk_message():
         - [ ] **Review content:** Check for typos and proper personalization
         - [ ] **Verify attachments:** Make sure attached files are correct
         - [ ] **Respect limits:** Don't exceed Gmail's sending limits (500/day recommended)
+        - The sending rate adapts automatically: it backs off when Gmail throttles and speeds up again afterwards
         
         ### 📊 What happens when you click Send:
-        1. **Connection:** App connects to Gmail using your credentials
-        2. **Processing:** Each email is personalized and prepared
-        3. **Sending:** Emails are sent one by one with progress updates
-        4. **Reporting:** You'll get a detailed summary of results
+        1. **Queueing:** A background send job is created; you can pause, cancel or queue more campaigns
+        2. **Connection:** The job connects to Gmail using your credentials
+        3. **Processing:** Each email is personalized and prepared
+        4. **Sending:** Emails are sent in parallel over several connections; progress refreshes every few seconds
+        5. **Reporting:** You'll get a detailed summary of results in the Send Jobs panel
         
         ### ⏱️ Estimated Time:
         - Small batch (1-50 emails): 1-2 minutes
@@ -364,9 +585,144 @@ def send_gmail_bulk_message():
         - Large batch (201-500 emails): 8-12 minutes
         """)
     
-    if st.button("📤 Send Gmail Bulk Messages", type="primary", help="Click to start sending emails to all recipients"):
-        starttime = time.time()
-        
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        connections = st.number_input("Parallel SMTP connections", min_value=1, max_value=MAX_CONNECTIONS,
+                                      value=DEFAULT_CONNECTIONS, step=1,
+                                      help="Number of authenticated Gmail connections used to send in parallel. More connections send faster; lower it if Gmail starts rejecting logins.")
+    with col2:
+        max_rate = st.number_input("Maximum sending rate (emails/second)", min_value=MIN_RATE,
+                                   value=DEFAULT_RATE, step=0.5,
+                                   help="Upper bound on the sending rate. The app slows down automatically when Gmail answers with temporary errors and speeds back up when sends succeed.")
+    with col3:
+        render_workers = st.number_input("Rendering processes", min_value=1, max_value=MAX_RENDER_WORKERS,
+                                         value=1, step=1,
+                                         help="Worker processes that personalize and encode emails ahead of sending. Raise it for large campaigns with long templates or attachments.")
+    
+    # Identical emails go out once per batch of recipients (all in BCC)
+    fanout = 1
+    if body_template.is_static and subject_template.is_static:
+        fanout = st.number_input("Recipients per email", min_value=1, max_value=MAX_FANOUT,
+                                 value=DEFAULT_FANOUT, step=10,
+                                 help="Every email is identical, so one copy is sent to a batch of recipients at once, each receiving it as a blind copy. This uploads the message and attachments once per batch instead of once per recipient. Set to 1 to send one email per recipient.")
+    
+    # Recipients are interleaved by domain so no single receiving domain gets
+    # a burst of messages
+    col1, col2 = st.columns(2)
+    with col1:
+        per_domain = st.number_input("Parallel sends per recipient domain (0 = no limit)", min_value=0,
+                                     max_value=MAX_CONNECTIONS, value=DEFAULT_PER_DOMAIN or 0, step=1,
+                                     help="Recipients are spread across their email domains and a domain that answers with temporary errors is paused while the others keep going. Set a limit if a large company or provider on your list should not receive several emails at once.")
+    with col2:
+        domain_rate = st.number_input("Maximum emails/second per domain (0 = unlimited)", min_value=0.0,
+                                      value=0.0, step=0.5)
+    
+    # Send journal: lets an interrupted campaign resume where it stopped
+    try:
+        journal = SendJournal()
+    except (OSError, sqlite3.Error) as e:
+        journal = None
+        st.warning(f"⚠️ Send journal unavailable, interrupted runs cannot be resumed: {e}")
+    campaign = campaign_id(sender_email, subject, message_template, memo, emailcolumn, digest)
+    already_sent = journal.completed(campaign) if journal is not None else set()
+    sent_today = journal.sent_last_day(sender_email) if journal is not None else 0
+    
+    # Send quota replaces the old hard 500-row limit; 0 means unlimited
+    col1, col2 = st.columns(2)
+    with col1:
+        per_run = st.number_input("Maximum emails this run (0 = unlimited)", min_value=0,
+                                  value=DEFAULT_PER_RUN, step=50,
+                                  help="Stop after this many emails. Remaining recipients can be sent later by resuming the campaign.")
+    with col2:
+        per_day = st.number_input("Daily sending limit (0 = unlimited)", min_value=0,
+                                  value=DEFAULT_PER_DAY, step=50,
+                                  help=f"Emails allowed per 24 hours from this account. {sent_today} already sent in the last 24 hours.")
+    quota = SendQuota(per_run or None, per_day or None, sent_today)
+    
+    # Extra Gmail accounts share the campaign: each one sends its part over
+    # its own connections and within its own daily limit
+    extra_accounts = []
+    with st.expander("👥 Additional sender accounts", expanded=False):
+        st.markdown("Spread large campaigns over several Gmail accounts. Each recipient gets the email from one of them; "
+                    "when an account reaches its daily limit or stops working, the others take over its recipients.")
+        extra_count = st.number_input("Number of additional accounts", min_value=0, max_value=MAX_EXTRA_ACCOUNTS,
+                                      value=0, step=1)
+        for i in range(extra_count):
+            col1, col2, col3, col4 = st.columns([3, 3, 2, 2])
+            with col1:
+                account_email = st.text_input("Gmail address", key=f"account_email_{i}")
+            with col2:
+                account_password = st.text_input("App password", type="password", key=f"account_password_{i}")
+            with col3:
+                account_per_day = st.number_input("Daily limit (0 = unlimited)", min_value=0, value=DEFAULT_PER_DAY,
+                                                  step=50, key=f"account_per_day_{i}")
+            with col4:
+                account_connections = st.number_input("Connections", min_value=1, max_value=MAX_CONNECTIONS,
+                                                      value=DEFAULT_CONNECTIONS, step=1, key=f"account_connections_{i}")
+            if account_email and account_password:
+                extra_accounts.append((account_email, account_password, account_per_day, account_connections))
+    if extra_accounts:
+        # Daily limits are kept per account; the run limit still applies
+        quota = SendQuota(per_run or None, None)
+    elif quota.exhausted:
+        st.warning("⚠️ The daily sending limit for this account has been reached. Resume the campaign later.")
+    
+    resume = True
+    if already_sent:
+        st.warning(f"📒 {len(already_sent)} recipient(s) of this campaign were already sent in a previous run.")
+        resume = st.checkbox("Skip recipients already sent in a previous run", value=True,
+                             help="Resume the interrupted campaign instead of sending everything again.")
+    
+    # Dry run: render every message to an on-disk spool that can be inspected
+    # and sent later with `python cli.py --drain PATH`
+    spool_path = None
+    if st.toggle("🧪 Dry run: write the messages to a spool instead of sending",
+                 help="Every personalized email is written to disk without connecting to Gmail. Open the spool to check the messages, then send it later from the command line."):
+        col1, col2 = st.columns(2)
+        with col1:
+            spool_format = st.selectbox("Spool format", SPOOL_FORMATS,
+                                        help="maildir: one file per email, readable by mail clients. bulk: a single file, fastest to write and send.")
+        with col2:
+            spool_dir = st.text_input("Spool folder", value=SPOOL_DIR)
+        spool_path = os.path.join(spool_dir, f"{campaign}.{spool_format}")
+    
+    if spool_path is not None and st.button("🧪 Write Spool", type="primary", help="Click to queue a background job that writes all emails to the spool"):
+        if not sender_email or not subject or not message_template:
+            st.error("⚠️ Please provide your Gmail address, a subject and a message template.")
+            return
+        attachments = cache_attachments(uploaddata)
+        builder = MessageBuilder(sender_email, attachments)
+        upload = io.BytesIO(file.getvalue())
+        upload_name = file.name
+        
+        def run_spool(job):
+            metrics = SendMetrics()
+            job.info["phase"] = "spooling"
+            run = Campaign(sender_email, emailcolumn, body_template, subject_template, builder, metrics=metrics)
+            directory = os.path.dirname(spool_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with create_spool(spool_path, spool_format, campaign=campaign, sender=sender_email) as writer:
+                
+                def checkpoint():
+                    job.sent = writer.count
+                    return job.checkpoint()
+                
+                job.sent = run.spool(writer, iter_valid_chunks(upload, upload_name, emailcolumn,
+                                                               columns=run.columns, digest=digest,
+                                                               validator=RecipientValidator(emailcolumn, keep, suppressed)),
+                                     checkpoint=checkpoint, render_workers=render_workers, on_result=job.record)
+            metrics.finish()
+            job.info["spool"] = spool_path
+            job.info["phase"] = "spooled"
+        
+        job = job_manager().submit(f"Dry run: {subject} ({valid_count} recipients)", run_spool, total=valid_count,
+                                   owner=job_owner(sender_email, sender_password),
+                                   on_finish=lambda: release_attachments(attachments))
+        st.success(f"🧪 Spool job #{job.id} queued. The messages will be written to `{spool_path}`.")
+        return
+    
+    if spool_path is None and st.button("📤 Send Gmail Bulk Messages", type="primary", help="Click to queue a background job that sends emails to all recipients"):
         # Validate inputs
         if not sender_email or not sender_password:
             st.error("⚠️ Please enter your Gmail credentials.")
@@ -375,100 +731,91 @@ def send_gmail_bulk_message():
         if not subject or not message_template:
             st.error("⚠️ Please provide both subject and message template.")
             return
-          # Progress tracking
-        status_text = st.empty()
-        result_container = st.container()
-        
-        # Show initial status
-        status_text.info("🔄 Preparing to send emails...")
-        
-        parts = []
-        if uploaddata is not None:
-            status_text.info("📎 Processing attachments...")
-            for pa in uploaddata:
-                filename = pa.name
-                attachment_bytes = pa.getvalue()
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(attachment_bytes)
-                encoders.encode_base64(part)
-                part.add_header("Content-Disposition", f"attachment; filename={filename}")
-                parts.append(part)
-            
+        
+        if resume and len(already_sent) >= valid_count:
+            st.success(f"✅ All {len(already_sent)} recipients of this campaign were already sent.")
+            return
+        if quota.exhausted:
+            st.error("⚠️ Sending limit reached. Raise the limit or resume the campaign later.")
+            return
+        
+        attachments = cache_attachments(uploaddata)
+        # Attachments and multipart boundaries are encoded once for the whole run
+        builder = MessageBuilder(sender_email, attachments)
+        
+        planned = valid_count - (len(already_sent) if resume else 0)
+        remaining = quota.remaining()
+        total_emails = planned if remaining is None else min(planned, remaining)
+        
+        # The job outlives this script run, so it gets its own copy of the upload
+        upload = io.BytesIO(file.getvalue())
+        upload_name = file.name
+        journal_path = journal.path if journal is not None else None
 
-        try:
-            # Gmail server setup
-            status_text.info("🔗 Connecting to Gmail server...")
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-            server.starttls()
-            server.login(sender_email, sender_password)
-            status_text.success("✅ Successfully connected to Gmail!")
-            time.sleep(1)
-            
-            # Initialize progress tracking
-            total_emails = len(filedata)
-            successful_sends = 0
-            failed_sends = 0
-            
-            # Send emails
-            status_text.info(f"📤 Starting to send {total_emails} emails...")
-            
-            for index, row in filedata.iterrows():
-                recipient_email = row[emailcolumn]
+        def run_campaign(job):
+            # Runs on the job worker thread: no Streamlit calls in here
+            job_journal = SendJournal(journal_path) if journal_path else None
+            try:
+                # What was sent and today's budgets are read when the job
+                # starts, not when it was queued: an earlier job of the same
+                # campaign or account may have sent in between.
+                def sent_last_day(account_email):
+                    return job_journal.sent_last_day(account_email) if job_journal is not None else 0
                 
-                # Update status for current email
-                status_text.info(f"📧 Sending email {index + 1}/{total_emails} to {recipient_email}")
-                
-                # Personalize message and subject
-                personalized_message = message_template
-                personalized_subject = subject
+                already_sent = job_journal.completed(campaign) if job_journal is not None and resume else None
+                accounts = None
+                if extra_accounts:
+                    quota = SendQuota(per_run or None, None)
+                    accounts = [Account(sender_email, sender_password, connections=connections, max_rate=max_rate,
+                                        per_day=per_day or None, sent_today=sent_last_day(sender_email))]
+                    for account_email, account_password, account_per_day, account_connections in extra_accounts:
+                        accounts.append(Account(account_email, account_password, connections=account_connections,
+                                                max_rate=max_rate, per_day=account_per_day or None,
+                                                sent_today=sent_last_day(account_email)))
+                else:
+                    quota = SendQuota(per_run or None, per_day or None, sent_last_day(sender_email))
+                metrics = SendMetrics()
+                domains = DomainLimiter(per_domain, domain_rate)
+                job.info["metrics"] = metrics
+                job.info["domains"] = domains
+                job.info["phase"] = "connecting"
+                run = Campaign(sender_email, emailcolumn, body_template, subject_template, builder,
+                               campaign_id=campaign, journal=job_journal,
+                               already_sent=already_sent, quota=quota, metrics=metrics, fanout=fanout)
+                if accounts:
+                    engine = limiter = AccountPool(accounts, metrics=metrics, domains=domains)
+                    job.info["accounts"] = engine
+                else:
+                    limiter = AdaptiveRateLimiter(max_rate=max_rate)
+                    engine = SendEngine(sender_email, sender_password, connections=connections, limiter=limiter,
+                                        metrics=metrics, domains=domains)
+                engine.open()
+                job.info["connections"] = engine.size
+                job.info["phase"] = "sending"
                 
-                for csv_col, template_var in memo.items():
-                    if template_var and csv_col in row:
-                        personalized_message = personalized_message.replace(f'{{{template_var}}}', str(row[csv_col]))
-                        personalized_subject = personalized_subject.replace(f'{{{template_var}}}', str(row[csv_col]))
+                def on_result(result):
+                    job.skipped = run.skipped
+                    job.record(result)
                 
                 try:
-                    # Create email
-                    msg = MIMEMultipart()
-                    msg['From'] = sender_email
-                    msg['To'] = recipient_email
-                    msg['Subject'] = personalized_subject
-                    msg.attach(MIMEText(personalized_message, 'plain'))
-                    
-                    # Add attachments
-                    for part in parts:
-                        msg.attach(part)
-                    
-                    # Send email
-                    server.sendmail(sender_email, recipient_email, msg.as_string())
-                    successful_sends += 1
-                    
-                    # Brief pause to avoid overwhelming the server
-                    time.sleep(0.1)
-                    
-                except Exception as e:
-                    failed_sends += 1
-                    with result_container:
-                        st.error(f"❌ Failed to send email to {recipient_email}: {str(e)}")
-            
-            # Final status
-            status_text.success(f"🎉 Email sending completed! ✅ {successful_sends} sent, ❌ {failed_sends} failed")            
-            server.quit()
-            endtime = time.time()
-            
-            # Final results
-            st.success(f"🎉 Bulk email sending completed!")
-            st.info(f"📊 **Results Summary:**\n"
-                   f"- Total emails attempted: {successful_sends + failed_sends}\n"
-                   f"- Successfully sent: {successful_sends}\n"
-                   f"- Errors: {failed_sends}\n"
-                   f"- Time taken: {endtime - starttime:.2f} seconds")
-            
-        except Exception as e:
-            st.error(f"❌ Error connecting to Gmail: {e}")
-            st.write("💡 **Troubleshooting tips:**")
-            st.write("- Make sure you're using an App Password, not your regular Gmail password")
-            st.write("- Enable 2-factor authentication and generate an App Password")
-            st.write("- Check if 'Less secure app access' is enabled (not recommended)")
-            if 'server' in locals():
-                server.quit()
\ No newline at end of file
+                    # Rows are streamed from the file in chunks and go straight to the senders
+                    run.run(engine, iter_valid_chunks(upload, upload_name, emailcolumn,
+                                                      columns=run.columns, digest=digest,
+                                                      validator=RecipientValidator(emailcolumn, keep, suppressed)),
+                            on_result=on_result, checkpoint=job.checkpoint, render_workers=render_workers)
+                finally:
+                    engine.close()
+                    metrics.finish()
+                job.skipped = run.skipped
+                job.info["throttles"] = limiter.throttles
+                job.info["final_rate"] = limiter.rate
+                job.info["deferred"] = max(0, valid_count - job.skipped - job.done)
+                job.info["phase"] = "finished"
+            finally:
+                if job_journal is not None:
+                    job_journal.close()
+        
+        job = job_manager().submit(f"{subject} ({total_emails} recipients)", run_campaign, total=total_emails,
+                                   owner=job_owner(sender_email, sender_password),
+                                   on_finish=lambda: release_attachments(attachments))
+        st.success(f"🚀 Send job #{job.id} queued for {total_emails} recipients. Track it under **📬 Send Jobs** above; you can keep working or close this tab and sign in again with the same address and app password to find it.")
@@ -1,6 +1,4 @@
 import streamlit as st
-from mail import send_gmail_message 
-from mail_bulk import send_gmail_bulk_message
 
 st.set_page_config(
     page_title="Gmail Message Sender",
@@ -45,8 +43,11 @@ with st.sidebar:
 
 
 
+# Only the selected page's modules are imported
 if app == "GMail":
+    from mail import send_gmail_message
     send_gmail_message()
 
 elif app == "GmailBulk":
+    from mail_bulk import send_gmail_bulk_message
     send_gmail_bulk_message()
\ No newline at end of file
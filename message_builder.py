@@ -0,0 +1,132 @@
+import uuid
+from email import encoders
+from email.generator import BytesGenerator
+from email.header import Header
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from email.policy import SMTP
+from io import BytesIO
+
+# Serialize-once multipart/mixed messages. The attachment section and the
+# multipart boundaries are rendered to bytes a single time per campaign;
+# each recipient only costs its own headers and text part. Attachments from
+# attachments.AttachmentCache stay on disk: messages then come out as
+# StreamedMessage and their files are read only while sending.
+
+CRLF = b'\r\n'
+STREAM_BLOCK = 1 << 16
+
+
+def serialize_part(part):
+    buffer = BytesIO()
+    BytesGenerator(buffer, mangle_from_=False, policy=SMTP).flatten(part)
+    return buffer.getvalue()
+
+
+def attachment_part(filename, data):
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(data)
+    encoders.encode_base64(part)
+    # As a parameter, so non-ASCII names get RFC 2231 encoding
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    return part
+
+
+def encode_header(name, value):
+    value = str(value)
+    try:
+        value.encode('ascii')
+        charset = 'us-ascii'
+    except UnicodeEncodeError:
+        charset = 'utf-8'
+    encoded = Header(value, charset, header_name=name).encode(linesep='\r\n')
+    # A first word too long for the line is pushed onto a continuation
+    # line, which reads back as a leading space; keep it on the first line.
+    if encoded.startswith('\r\n '):
+        encoded = encoded[3:]
+    return f"{name}: {encoded}".encode('ascii') + CRLF
+
+
+class StreamedMessage:
+    """Message whose attachment parts are files on disk.
+
+    segments holds bytes and attachments.EncodedAttachment objects in wire
+    order. The object stays small, so it is cheap to queue and to pass to
+    render worker processes.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.size = sum(len(segment) if isinstance(segment, bytes) else segment.size for segment in segments)
+
+    def __len__(self):
+        return self.size
+
+    def chunks(self, block=STREAM_BLOCK):
+        for segment in self.segments:
+            if isinstance(segment, bytes):
+                yield segment
+                continue
+            with open(segment.path, 'rb') as f:
+                while True:
+                    data = f.read(block)
+                    if not data:
+                        break
+                    yield data
+
+    def to_bytes(self):
+        return b''.join(self.chunks())
+
+
+class MessageBuilder:
+    def __init__(self, sender_email, attachments=()):
+        # attachments holds (filename, bytes) pairs or, to keep them on
+        # disk, attachments.EncodedAttachment objects.
+        self.sender_email = sender_email
+        self.boundary = '===============' + uuid.uuid4().hex + '=='
+        delimiter = b'--' + self.boundary.encode('ascii')
+
+        self._head = (
+            f'Content-Type: multipart/mixed; boundary="{self.boundary}"'.encode('ascii') + CRLF
+            + b'MIME-Version: 1.0' + CRLF
+            + encode_header('From', sender_email)
+        )
+        self._open = CRLF + delimiter + CRLF
+        # Consecutive in-memory pieces are joined; files stay separate.
+        tail = []
+        pending = []
+        for attachment in attachments:
+            pending.append(CRLF + delimiter + CRLF)
+            if isinstance(attachment, tuple):
+                filename, data = attachment
+                pending.append(serialize_part(attachment_part(filename, data)))
+            else:
+                tail.append(b''.join(pending))
+                tail.append(attachment)
+                pending = []
+        pending.append(CRLF + delimiter + b'--' + CRLF)
+        tail.append(b''.join(pending))
+        self._tail = tail[0] if len(tail) == 1 else tuple(tail)
+
+    @property
+    def streamed(self):
+        return not isinstance(self._tail, bytes)
+
+    @property
+    def shared_size(self):
+        # Bytes every message holds in memory besides its own headers and
+        # text; attachments kept on disk do not count.
+        tail = [self._tail] if isinstance(self._tail, bytes) else self._tail
+        return len(self._head) + len(self._open) + sum(len(part) for part in tail if isinstance(part, bytes))
+
+    def build(self, recipient, subject, body):
+        parts = (
+            self._head,
+            encode_header('To', recipient),
+            encode_header('Subject', subject),
+            self._open,
+            serialize_part(MIMEText(body, 'plain')),
+        )
+        if isinstance(self._tail, bytes):
+            return b''.join(parts + (self._tail,))
+        return StreamedMessage((b''.join(parts),) + self._tail)
@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Lightweight hot-path instrumentation for the senders. Each phase (connect,
+# starttls, login, render, serialize, smtp_send, ...) gets a fixed-bucket
+# latency histogram; results can be exported as JSON or in the Prometheus
+# text exposition format.
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MAX_RECIPIENT_TIMINGS = 100000
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value, count=1):
+        # count > 1 records the same per-item latency for a batch of items.
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                slot = i
+                break
+        self.counts[slot] += count
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'min': self.min or 0.0,
+            'max': self.max or 0.0,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+class SendMetrics:
+    def __init__(self, max_recipients=MAX_RECIPIENT_TIMINGS):
+        self.phases = {}
+        self.sent = 0
+        self.failed = 0
+        self.started = time.time()
+        self.finished = None
+        self.recipients = deque(maxlen=max_recipients)
+        self._lock = threading.Lock()
+
+    def observe(self, phase, seconds, count=1):
+        with self._lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.observe(seconds, count)
+
+    def merge(self, phases):
+        # Fold in histograms recorded elsewhere, e.g. in a worker process.
+        with self._lock:
+            for phase, histogram in phases.items():
+                target = self.phases.get(phase)
+                if target is None:
+                    target = self.phases[phase] = Histogram(histogram.buckets)
+                target.merge(histogram)
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def record(self, result):
+        # One send_engine.SendResult per recipient.
+        with self._lock:
+            if result.ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.recipients.append((str(result.index), result.recipient, result.ok, result.elapsed))
+
+    def finish(self):
+        self.finished = time.time()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        elapsed = self.elapsed
+        return (self.sent + self.failed) / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self, include_recipients=True):
+        with self._lock:
+            data = {
+                'started': self.started,
+                'elapsed': self.elapsed,
+                'sent': self.sent,
+                'failed': self.failed,
+                'throughput': self.throughput,
+                'phases': {name: histogram.to_dict() for name, histogram in self.phases.items()},
+            }
+            if include_recipients:
+                data['recipients'] = [
+                    {'row': row, 'recipient': recipient, 'ok': ok, 'seconds': seconds}
+                    for row, recipient, ok, seconds in self.recipients
+                ]
+        return data
+
+    def to_json(self, include_recipients=True):
+        return json.dumps(self.to_dict(include_recipients), indent=2)
+
+    def to_prometheus(self, prefix='mail', labels=None):
+        base = dict(labels or {})
+
+        def series(name, value, **extra):
+            merged = dict(base, **extra)
+            label_text = ','.join(f'{key}="{merged[key]}"' for key in merged)
+            name = f"{prefix}_{name}{{{label_text}}}" if label_text else f"{prefix}_{name}"
+            return f"{name} {value}"
+
+        lines = [
+            f"# HELP {prefix}_messages_total Messages handed to SMTP, by outcome.",
+            f"# TYPE {prefix}_messages_total counter",
+            series('messages_total', self.sent, outcome='sent'),
+            series('messages_total', self.failed, outcome='failed'),
+            f"# HELP {prefix}_throughput_messages_per_second Average send throughput.",
+            f"# TYPE {prefix}_throughput_messages_per_second gauge",
+            series('throughput_messages_per_second', f"{self.throughput:.6f}"),
+            f"# HELP {prefix}_phase_seconds Latency of each send phase.",
+            f"# TYPE {prefix}_phase_seconds histogram",
+        ]
+        with self._lock:
+            for phase, histogram in sorted(self.phases.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(series('phase_seconds_bucket', cumulative, phase=phase, le=bound))
+                lines.append(series('phase_seconds_sum', f"{histogram.sum:.6f}", phase=phase))
+                lines.append(series('phase_seconds_count', histogram.count, phase=phase))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,35 @@
+import streamlit as st
+
+# Streamlit rendering of metrics.SendMetrics, shared by the single and bulk
+# sender pages.
+
+PHASE_ORDER = ['connect', 'starttls', 'login', 'render', 'serialize', 'rate_wait', 'connection_wait', 'smtp_send']
+
+
+def show_send_metrics(metrics, key, labels=None, expanded=False):
+    data = metrics.to_dict(include_recipients=False)
+    with st.expander("⏱️ Performance metrics", expanded=expanded):
+        st.write(f"**Throughput:** {data['throughput']:.2f} emails/second over {data['elapsed']:.2f} seconds")
+        phases = sorted(data['phases'].items(),
+                        key=lambda item: PHASE_ORDER.index(item[0]) if item[0] in PHASE_ORDER else len(PHASE_ORDER))
+        rows = [
+            {
+                "Phase": name,
+                "Count": phase['count'],
+                "Mean (ms)": round(phase['mean'] * 1000, 2),
+                "p50 (ms)": round(phase['p50'] * 1000, 2),
+                "p99 (ms)": round(phase['p99'] * 1000, 2),
+                "Max (ms)": round(phase['max'] * 1000, 2),
+                "Total (s)": round(phase['sum'], 3),
+            }
+            for name, phase in phases
+        ]
+        if rows:
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("📥 Export JSON", data=metrics.to_json(), file_name=f"{key}_metrics.json",
+                               mime="application/json", key=f"{key}_metrics_json")
+        with col2:
+            st.download_button("📥 Export Prometheus", data=metrics.to_prometheus(labels=labels),
+                               file_name=f"{key}_metrics.prom", mime="text/plain", key=f"{key}_metrics_prom")
@@ -0,0 +1,132 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue, Full, Empty
+
+# Process-pool rendering stage. Chunks of rows are split into batches,
+# rendered and serialized to message bytes in worker processes, and put on
+# a bounded queue that the SMTP senders drain. Rendering and network I/O
+# overlap, and CPU work is spread over every core instead of one GIL.
+
+BATCH_ROWS = 500
+BATCH_BYTES = 32 << 20
+QUEUE_BATCHES = 2
+
+_state = None
+
+
+def _init_worker(body_template, subject_template, builder):
+    # Templates and the serialized attachment section are shipped to each
+    # worker once, not with every batch.
+    global _state
+    _state = (body_template, subject_template, builder)
+
+
+def _render_batch(batch):
+    from campaign import render_batch
+    from metrics import SendMetrics
+
+    body_template, subject_template, builder = _state
+    metrics = SendMetrics(max_recipients=0)
+    messages = list(render_batch(body_template, subject_template, builder, batch, metrics))
+    return messages, metrics.phases
+
+
+def _context():
+    # Workers are started through a fork server (spawn where there is
+    # none), never forked from this process: it runs the Streamlit server,
+    # the SMTP sender threads and SQLite, and a fork while another thread
+    # holds the import or logging lock can deadlock the child.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+class RenderPipeline:
+    def __init__(self, body_template, subject_template, builder, workers=None,
+                 metrics=None, batch_rows=BATCH_ROWS, queue_batches=QUEUE_BATCHES):
+        self.body_template = body_template
+        self.subject_template = subject_template
+        self.builder = builder
+        self.workers = workers or default_workers()
+        self.metrics = metrics
+        # Keep a batch of rendered messages around BATCH_BYTES even when
+        # every message carries large attachments.
+        per_message = max(1, builder.shared_size)
+        self.batch_rows = max(1, min(batch_rows, BATCH_BYTES // per_message))
+        self.queue_batches = queue_batches
+
+    def _split(self, batches):
+        for batch in batches:
+            yield from batch.slices(self.batch_rows)
+
+    def _produce(self, chunks, output, stop):
+        # Runs on a helper thread: keeps up to `workers` batches rendering
+        # and moves finished ones, in order, onto the bounded output queue.
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=_context(),
+                                     initializer=_init_worker,
+                                     initargs=(self.body_template, self.subject_template,
+                                               self.builder)) as pool:
+                pending = []
+                batches = self._split(chunks)
+                exhausted = False
+                while not stop.is_set() and (pending or not exhausted):
+                    while not exhausted and len(pending) < self.workers:
+                        batch = next(batches, None)
+                        if batch is None:
+                            exhausted = True
+                        else:
+                            pending.append(pool.submit(_render_batch, batch))
+                    if not pending:
+                        break
+                    messages, phases = pending.pop(0).result()
+                    if self.metrics is not None:
+                        self.metrics.merge(phases)
+                    if not self._put(output, messages, stop):
+                        break
+                for future in pending:
+                    future.cancel()
+        except Exception as e:
+            self._put(output, e, stop)
+        finally:
+            self._put(output, None, stop)
+
+    def _put(self, output, item, stop):
+        while not stop.is_set():
+            try:
+                output.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def messages(self, chunks):
+        # Yields (row index, recipient, message bytes) like
+        # Campaign.messages. Closing the generator stops the workers.
+        output = Queue(maxsize=self.queue_batches)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(chunks, output, stop),
+                                    name='render-pipeline', daemon=True)
+        producer.start()
+        try:
+            while True:
+                try:
+                    item = output.get(timeout=0.5)
+                except Empty:
+                    if not producer.is_alive() and output.empty():
+                        return
+                    continue
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield from item
+        finally:
+            stop.set()
+            producer.join(timeout=30)
@@ -0,0 +1,43 @@
+import threading
+
+# Send budgets. A limit of None means unlimited. The per-day budget is
+# seeded with what the journal already recorded as sent today.
+
+DEFAULT_PER_RUN = 500
+DEFAULT_PER_DAY = 500
+
+
+class SendQuota:
+    def __init__(self, per_run=DEFAULT_PER_RUN, per_day=DEFAULT_PER_DAY, sent_today=0):
+        self.per_run = per_run
+        self.per_day = per_day
+        self.sent_today = sent_today
+        self.taken = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        limits = []
+        if self.per_run is not None:
+            limits.append(self.per_run - self.taken)
+        if self.per_day is not None:
+            limits.append(self.per_day - self.sent_today - self.taken)
+        if not limits:
+            return None
+        return max(0, min(limits))
+
+    def take(self, count=1):
+        # Reserve up to `count` sends; returns how many were granted.
+        with self._lock:
+            remaining = self.remaining()
+            granted = count if remaining is None else min(count, remaining)
+            self.taken += granted
+            return granted
+
+    def release(self, count=1):
+        # Give back sends that were reserved but not made.
+        with self._lock:
+            self.taken = max(0, self.taken - count)
+
+    @property
+    def exhausted(self):
+        return self.remaining() == 0
@@ -0,0 +1,86 @@
+import smtplib
+import threading
+import time
+
+# Adaptive token bucket shared by all sending threads. It starts at the
+# configured ceiling, halves the rate and pauses when the server answers with
+# a temporary (4xx) failure, and climbs back additively while sends succeed.
+
+DEFAULT_RATE = 5.0
+MIN_RATE = 0.2
+MAX_COOLDOWN = 300.0
+
+
+def is_temporary(exc):
+    # 4xx replies (421 service not available, 450/451/452 try again later)
+    # and dropped connections are worth retrying after backing off.
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    return False
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, max_rate=DEFAULT_RATE, min_rate=MIN_RATE, burst=None,
+                 increase=0.1, decrease=0.5, cooldown=2.0):
+        self.max_rate = float(max_rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.rate = self.max_rate
+        self.burst = float(burst or max(1.0, self.max_rate))
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.throttles = 0
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._strikes = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        # Blocks until a send may start.
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(min(wait, 1.0))
+
+    @property
+    def paused(self):
+        return time.monotonic() < self._paused_until
+
+    def on_success(self):
+        with self._lock:
+            self._strikes = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        # Multiplicative decrease plus an exponentially growing pause while
+        # the server keeps refusing.
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttles += 1
+            # Connections refused during the same pause count as one strike,
+            # so N connections do not grow the pause N times over.
+            if now >= self._paused_until:
+                self._strikes += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = 0.0
+            pause = min(MAX_COOLDOWN, self.cooldown * 2 ** (self._strikes - 1))
+            self._paused_until = max(self._paused_until, now + pause)
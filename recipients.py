@@ -0,0 +1,51 @@
+# Compact recipient batches for the send queue. Once a chunk has been
+# validated and selected, the rows that go on to rendering keep only their
+# key, their address and the template fields, each as a plain list of
+# strings. Field values that repeat (a company, a city) share one string
+# object, so a recipient costs a pointer per field plus its own address
+# instead of a slice of a DataFrame. Senders and render workers take
+# slices of a batch; no pandas row is ever boxed.
+
+
+class RecipientBatch:
+    __slots__ = ('keys', 'emails', 'fields')
+
+    def __init__(self, keys, emails, fields):
+        # keys: row keys as in the recipient file (journal and results use
+        # them), emails: addresses, fields: column -> list of rendered text.
+        self.keys = keys
+        self.emails = emails
+        self.fields = fields
+
+    @classmethod
+    def from_frame(cls, frame, emailcolumn, columns=()):
+        # Cells are converted with str() like template rendering always has,
+        # so "nan" and "None" come out as before.
+        import pandas as pd
+
+        fields = {}
+        for column in columns:
+            if column in fields:
+                continue
+            text = frame[column].astype(str)
+            if column != emailcolumn:
+                codes, uniques = pd.factorize(text, use_na_sentinel=False)
+                fields[column] = uniques.take(codes).tolist()
+            else:
+                fields[column] = text.tolist()
+        emails = fields[emailcolumn] if emailcolumn in fields else frame[emailcolumn].astype(str).tolist()
+        return cls(frame.index.tolist(), emails, fields)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, column):
+        return self.fields[column]
+
+    def slice(self, start, stop):
+        return RecipientBatch(self.keys[start:stop], self.emails[start:stop],
+                              {column: values[start:stop] for column, values in self.fields.items()})
+
+    def slices(self, size):
+        for start in range(0, len(self), size):
+            yield self.slice(start, start + size)
@@ -0,0 +1,546 @@
+import re
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from queue import Queue, Empty
+from message_builder import StreamedMessage
+from domains import domain_of, interleave, job_domains
+from rate_limit import is_temporary
+
+# Headless send engine shared by the Streamlit pages and any other caller.
+# Nothing in here may import streamlit.
+
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 587
+DEFAULT_CONNECTIONS = 4
+MAX_CONNECTIONS = 10
+# Sessions are replaced after this many messages or seconds, before the
+# provider cuts them; 0 turns either limit off.
+ROTATE_MESSAGES = 500
+ROTATE_SECONDS = 15 * 60
+RECONNECT_RETRIES = 3
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+LEADING_DOT = re.compile(br'(?m)^\.')
+
+
+def open_smtp_connection(sender_email, sender_password, host=SMTP_HOST, port=SMTP_PORT, timeout=60,
+                         metrics=None, starttls=True):
+    # starttls=False is only meant for local test servers.
+    if metrics is None:
+        server = smtplib.SMTP(host, port, timeout=timeout)
+        if starttls:
+            server.starttls()
+        server.login(sender_email, sender_password)
+        return server
+    with metrics.timer('connect'):
+        server = smtplib.SMTP(host, port, timeout=timeout)
+    if starttls:
+        with metrics.timer('starttls'):
+            server.starttls()
+    with metrics.timer('login'):
+        server.login(sender_email, sender_password)
+    return server
+
+
+def close_smtp_connection(server):
+    try:
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+def send_message(server, from_addr, recipients, message):
+    # smtplib's sendmail for bytes. A message_builder.StreamedMessage goes
+    # through the same MAIL/RCPT/DATA exchange, but its attachment files
+    # are streamed onto the socket instead of being loaded as one payload.
+    if not isinstance(message, StreamedMessage):
+        return server.sendmail(from_addr, recipients, message)
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    server.ehlo_or_helo_if_needed()
+    options = [f"size={message.size}"] if server.does_esmtp and server.has_extn('size') else []
+    code, reply = server.mail(from_addr, options)
+    if code != 250:
+        _abort(server, code)
+        raise smtplib.SMTPSenderRefused(code, reply, from_addr)
+    refused = {}
+    for recipient in recipients:
+        code, reply = server.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, reply)
+        if code == 421:
+            server.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(recipients):
+        _abort(server, None)
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, reply = server.docmd('data')
+    if code != 354:
+        raise smtplib.SMTPDataError(code, reply)
+    if server.sock is None:
+        raise smtplib.SMTPServerDisconnected('please run connect() first')
+    try:
+        for segment in message.segments:
+            if isinstance(segment, bytes):
+                # Text parts may have lines starting with a dot. Encoded
+                # attachment parts never do and are sent as they are.
+                server.sock.sendall(LEADING_DOT.sub(b'..', segment))
+            else:
+                with open(segment.path, 'rb') as f:
+                    server.sock.sendfile(f)
+        server.sock.sendall(b'.\r\n')
+    except OSError as e:
+        server.close()
+        raise smtplib.SMTPServerDisconnected(f"connection lost while sending: {e}")
+    code, reply = server.getreply()
+    if code != 250:
+        _abort(server, code)
+        raise smtplib.SMTPDataError(code, reply)
+    return refused
+
+
+def _abort(server, code):
+    if code == 421:
+        server.close()
+        return
+    try:
+        server.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+class SMTPSession:
+    """A logged-in SMTP connection that survives being dropped.
+
+    send() notices when the connection was lost or closed by the server
+    (a 421 reply), logs in again and retries the message, backing off
+    exponentially between attempts. The connection is also replaced after
+    rotate_messages messages or rotate_seconds seconds.
+    """
+
+    def __init__(self, sender_email, sender_password, host=SMTP_HOST, port=SMTP_PORT, starttls=True,
+                 metrics=None, retries=RECONNECT_RETRIES, rotate_messages=ROTATE_MESSAGES,
+                 rotate_seconds=ROTATE_SECONDS):
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.metrics = metrics
+        self.retries = retries
+        self.rotate_messages = rotate_messages
+        self.rotate_seconds = rotate_seconds
+        self.server = None
+        self.opened = 0.0
+        self.messages = 0
+        self.reconnects = 0
+        self.rotations = 0
+
+    @property
+    def connected(self):
+        return self.server is not None and self.server.sock is not None
+
+    def connect(self):
+        self.close()
+        self.server = open_smtp_connection(self.sender_email, self.sender_password, self.host, self.port,
+                                           metrics=self.metrics, starttls=self.starttls)
+        self.opened = time.monotonic()
+        self.messages = 0
+        return self
+
+    def close(self):
+        if self.server is not None:
+            close_smtp_connection(self.server)
+            self.server = None
+
+    def _delay(self, attempt):
+        return min(MAX_RECONNECT_DELAY, RECONNECT_DELAY * 2 ** attempt)
+
+    def reconnect(self):
+        # Also makes the first connection of a session that was never
+        # opened. A refused login is final; network errors are retried. If
+        # the server stays unreachable, server is left as None.
+        attempt = 0
+        first = not self.opened
+        reconnecting = time.perf_counter()
+        while True:
+            try:
+                self.connect()
+                break
+            except smtplib.SMTPAuthenticationError:
+                raise
+            except OSError as e:
+                self.server = None
+                if attempt >= self.retries:
+                    if isinstance(e, smtplib.SMTPException):
+                        raise
+                    raise smtplib.SMTPServerDisconnected(f"could not reconnect to {self.host}: {e}") from e
+                time.sleep(self._delay(attempt))
+                attempt += 1
+        if first:
+            return
+        self.reconnects += 1
+        if self.metrics is not None:
+            self.metrics.observe('reconnect', time.perf_counter() - reconnecting)
+
+    def _due(self):
+        if self.rotate_messages and self.messages >= self.rotate_messages:
+            return True
+        return bool(self.rotate_seconds) and time.monotonic() - self.opened >= self.rotate_seconds
+
+    def send(self, from_addr, recipients, message):
+        # send_message on this session. Errors the server answered on a
+        # live connection (refused recipients, 5xx) are raised as they are.
+        if self.connected and self._due():
+            self.rotations += 1
+            self.close()
+        attempt = 0
+        while True:
+            if not self.connected:
+                self.reconnect()
+            try:
+                refused = send_message(self.server, from_addr, recipients, message)
+            except Exception:
+                if self.connected or attempt >= self.retries:
+                    raise
+                # A connection found dead is usually just an idle timeout:
+                # reopen it at once and back off only if that fails too.
+                if attempt:
+                    time.sleep(self._delay(attempt - 1))
+                attempt += 1
+                continue
+            self.messages += 1
+            return refused
+
+
+class NoConnectionError(smtplib.SMTPException):
+    pass
+
+
+def is_sender_error(exc):
+    # Failures of the sending account or relay rather than of the recipient:
+    # login or MAIL FROM refused (e.g. a daily quota), the service closing
+    # with 421, or every connection lost. Another account may still succeed.
+    if isinstance(exc, (smtplib.SMTPAuthenticationError, smtplib.SMTPSenderRefused,
+                        smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, NoConnectionError)):
+        return True
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code == 421
+
+
+@dataclass
+class SendResult:
+    index: object
+    recipient: str
+    ok: bool
+    error: str = ''
+    elapsed: float = 0.0
+    # Sending account, and whether the failure was the account's
+    # (see is_sender_error) rather than the recipient's.
+    account: str = ''
+    sender_failed: bool = False
+
+
+class SendEngine:
+    """Pool of authenticated SMTP connections driven by a thread pool.
+
+    Use as a context manager: connections are opened on enter (in parallel)
+    and closed on exit. `send_all` spreads jobs across the pool and reports
+    one SendResult per job.
+    """
+
+    def __init__(self, sender_email, sender_password, connections=DEFAULT_CONNECTIONS,
+                 host=SMTP_HOST, port=SMTP_PORT, limiter=None, retries=3, metrics=None, starttls=True,
+                 domains=None, rotate_messages=ROTATE_MESSAGES, rotate_seconds=ROTATE_SECONDS):
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self.connections = max(1, min(int(connections), MAX_CONNECTIONS))
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        # Shared AdaptiveRateLimiter; temporary 4xx failures are retried up
+        # to `retries` times after the limiter has backed off.
+        self.limiter = limiter
+        self.retries = retries
+        # Optional metrics.SendMetrics collecting per-phase latencies and
+        # per-recipient results.
+        self.metrics = metrics
+        # Optional domains.DomainLimiter: per-recipient-domain concurrency
+        # and rate caps, and jobs interleaved across domains in send_all.
+        self.domains = domains
+        # Each connection is an SMTPSession, reconnected when dropped and
+        # rotated after this many messages or seconds.
+        self.rotate_messages = rotate_messages
+        self.rotate_seconds = rotate_seconds
+        self._idle = Queue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def connect(self):
+        session = SMTPSession(self.sender_email, self.sender_password, self.host, self.port, self.starttls,
+                              metrics=self.metrics, rotate_messages=self.rotate_messages,
+                              rotate_seconds=self.rotate_seconds)
+        return session.connect()
+
+    def open(self):
+        # Log in on all connections at once; the first login error is raised
+        # so a bad password fails fast instead of once per recipient.
+        with ThreadPoolExecutor(max_workers=self.connections) as pool:
+            futures = [pool.submit(self.connect) for _ in range(self.connections)]
+        errors = []
+        for future in futures:
+            try:
+                session = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            self._all.append(session)
+            self._idle.put(session)
+        if not self._all:
+            raise errors[0]
+        self._executor = ThreadPoolExecutor(max_workers=len(self._all), thread_name_prefix='smtp-send')
+        return self
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            sessions, self._all = self._all, []
+        for session in sessions:
+            session.close()
+        self._idle = Queue()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def size(self):
+        return len(self._all)
+
+    def _drop(self, session):
+        # A session that could not log in again leaves the pool, so the rest
+        # of the run is not stuck on a dead server.
+        session.close()
+        with self._lock:
+            if session in self._all:
+                self._all.remove(session)
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if not self._all:
+                    return None
+            try:
+                return self._idle.get(timeout=1)
+            except Empty:
+                continue
+
+    def send(self, index, recipient, message, from_addr=None, record=True):
+        # record=False leaves metrics.record to the caller, e.g. when a
+        # failed send may still be retried on another account.
+        result = self._send(index, recipient, message, from_addr)
+        result.account = self.sender_email
+        if record and self.metrics is not None:
+            self.metrics.record(result)
+        return result
+
+    def send_batch(self, indexes, recipients, message, from_addr=None, record=True):
+        # Fan-out: one transaction with a RCPT TO per recipient, for
+        # messages that are identical for everyone. Returns one SendResult
+        # per recipient.
+        results = self._send_batch(indexes, recipients, message, from_addr)
+        for result in results:
+            result.account = self.sender_email
+            if record and self.metrics is not None:
+                self.metrics.record(result)
+        return results
+
+    def submit(self, index, recipient, message, record=True):
+        # Queue one send_all job on the pool. The future resolves to a
+        # SendResult, or to a list of them for a fan-out batch.
+        if self._executor is None:
+            raise RuntimeError("SendEngine is not open")
+        if isinstance(recipient, list):
+            return self._executor.submit(self.send_batch, index, recipient, message, record=record)
+        return self._executor.submit(self.send, index, recipient, message, record=record)
+
+    def _transaction(self, recipients, message, from_addr):
+        # One rate-limited SMTP transaction on an idle connection. Returns
+        # the recipients the server refused, as smtplib's sendmail does, and
+        # the exception that failed the whole transaction, if any.
+        metrics = self.metrics
+        if self.domains is None:
+            return self._transact(recipients, message, from_addr)
+        domains = job_domains(recipients)
+        waited = time.perf_counter()
+        self.domains.acquire(domains)
+        if metrics is not None:
+            metrics.observe('domain_wait', time.perf_counter() - waited)
+        try:
+            return self._transact(recipients, message, from_addr)
+        finally:
+            self.domains.release(domains)
+
+    def _transact(self, recipients, message, from_addr):
+        metrics = self.metrics
+        if self.limiter is not None:
+            waited = time.perf_counter()
+            self.limiter.acquire()
+            if metrics is not None:
+                metrics.observe('rate_wait', time.perf_counter() - waited)
+        waited = time.perf_counter()
+        session = self._acquire()
+        if metrics is not None:
+            metrics.observe('connection_wait', time.perf_counter() - waited)
+        if session is None:
+            return {}, NoConnectionError("No SMTP connection available")
+        refused = {}
+        error = None
+        sending = time.perf_counter()
+        try:
+            refused = session.send(from_addr or self.sender_email, recipients, message)
+        except Exception as e:
+            error = e
+            if session.server is None:
+                self._drop(session)
+                session = None
+        finally:
+            if metrics is not None:
+                metrics.observe('smtp_send', time.perf_counter() - sending)
+            if session is not None:
+                self._idle.put(session)
+        return refused, error
+
+    def _back_off(self, attempt, deferred=None):
+        # deferred: recipients the receiving side refused with a 4xx. With
+        # a DomainLimiter only their domains back off, not the whole run.
+        if deferred and self.domains is not None:
+            self.domains.on_throttle(job_domains(deferred))
+            return
+        if self.limiter is not None:
+            self.limiter.on_throttle()
+        else:
+            time.sleep(2 ** attempt)
+
+    def _send(self, index, recipient, message, from_addr):
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            _, error = self._transaction(recipient, message, from_addr)
+            if error is None:
+                if self.limiter is not None:
+                    self.limiter.on_success()
+                if self.domains is not None:
+                    self.domains.on_success([domain_of(recipient)])
+                return SendResult(index, recipient, True, elapsed=time.perf_counter() - start)
+            if is_temporary(error) and attempt < self.retries:
+                self._back_off(attempt, recipient if isinstance(error, smtplib.SMTPRecipientsRefused) else None)
+                attempt += 1
+                continue
+            return SendResult(index, recipient, False, str(error), time.perf_counter() - start,
+                              sender_failed=is_sender_error(error))
+
+    def _send_batch(self, indexes, recipients, message, from_addr):
+        start = time.perf_counter()
+        pending = list(zip(indexes, recipients))
+        results = []
+        attempt = 0
+        while pending:
+            refused, error = self._transaction([recipient for _, recipient in pending], message, from_addr)
+            if isinstance(error, smtplib.SMTPRecipientsRefused):
+                codes = [code for code, _ in error.recipients.values()]
+                if 421 in codes or len(error.recipients) < len(pending):
+                    # The server hung up during RCPT TO: DATA was never
+                    # sent, so nobody in the batch got the message.
+                    error = smtplib.SMTPServerDisconnected(
+                        f"connection closed during RCPT TO ({', '.join(map(str, codes)) or 'no reply'})")
+                else:
+                    # Every RCPT TO was refused; handled like partial refusals.
+                    refused, error = error.recipients, None
+            if error is not None:
+                if is_temporary(error) and attempt < self.retries:
+                    self._back_off(attempt)
+                    attempt += 1
+                    continue
+                elapsed = time.perf_counter() - start
+                results.extend(SendResult(index, recipient, False, str(error), elapsed,
+                                          sender_failed=is_sender_error(error))
+                               for index, recipient in pending)
+                break
+            elapsed = time.perf_counter() - start
+            retry = []
+            for index, recipient in pending:
+                if recipient not in refused:
+                    results.append(SendResult(index, recipient, True, elapsed=elapsed))
+                    continue
+                code, reply = refused[recipient]
+                if 400 <= code < 500 and attempt < self.retries:
+                    retry.append((index, recipient))
+                else:
+                    reason = reply.decode('utf-8', 'replace') if isinstance(reply, bytes) else str(reply)
+                    results.append(SendResult(index, recipient, False, f"{code} {reason}", elapsed))
+            if len(retry) < len(pending) and self.limiter is not None:
+                self.limiter.on_success()
+            if self.domains is not None:
+                self.domains.on_success([domain_of(recipient) for _, recipient in pending
+                                         if recipient not in refused])
+            pending = retry
+            if pending:
+                self._back_off(attempt, [recipient for _, recipient in pending])
+                attempt += 1
+        return results
+
+    def send_all(self, jobs, on_result=None, checkpoint=None):
+        # jobs yields (index, recipient, message), or (indexes, recipients,
+        # message) with lists for a fan-out batch. Only a bounded number of
+        # jobs is pulled from the iterator at a time, so messages can be
+        # rendered lazily while earlier ones are on the wire. on_result runs
+        # in the calling thread. checkpoint(block), if given, is called before
+        # each new job is taken; returning False stops the run after the
+        # messages already in flight. While messages are in flight it is
+        # called with block=False and None means "not now": their results
+        # are collected before it is called again, blocking.
+        if self._executor is None:
+            raise RuntimeError("SendEngine is not open")
+        results = []
+        pending = set()
+        limit = self.size * 2
+        if self.domains is not None:
+            jobs = interleave(jobs, self.domains)
+        jobs = iter(jobs)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < limit:
+                if checkpoint is not None:
+                    go = checkpoint(block=not pending)
+                    if go is None:
+                        break
+                    if not go:
+                        exhausted = True
+                        break
+                try:
+                    index, recipient, message = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(self.submit(index, recipient, message))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = future.result()
+                for result in batch if isinstance(batch, list) else (batch,):
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+        return results
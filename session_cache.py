@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import time
+
+from send_engine import SMTP_HOST, SMTP_PORT, SMTPSession
+
+# Logged-in SMTP sessions kept between one-off sends. The single-message
+# page sends through one SMTPSession per credential instead of connecting,
+# doing STARTTLS and logging in for every email, so a repeat send costs one
+# MAIL/RCPT/DATA exchange. A background thread sends NOOP on idle sessions
+# so the server does not drop them, and closes sessions unused for a while.
+
+KEEPALIVE_SECONDS = 60
+IDLE_SECONDS = 5 * 60
+
+
+class _Entry:
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.used = time.monotonic()
+
+
+class SessionCache:
+    def __init__(self, keepalive=KEEPALIVE_SECONDS, idle=IDLE_SECONDS):
+        self.keepalive = keepalive
+        self.idle = idle
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _entry(self, sender_email, sender_password, host, port, starttls):
+        # Keyed by a hash of the password, so a changed password gets a new
+        # session instead of the old login.
+        key = (host, port, starttls, sender_email,
+               hashlib.sha256(sender_password.encode('utf-8')).hexdigest())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(
+                    SMTPSession(sender_email, sender_password, host, port, starttls))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._maintain, name='smtp-keepalive', daemon=True)
+                self._thread.start()
+        return key, entry
+
+    def send(self, sender_email, sender_password, recipients, message, host=SMTP_HOST, port=SMTP_PORT,
+             starttls=True, metrics=None):
+        # Returns the recipients the server refused, like smtplib's
+        # sendmail. The first send for a credential logs in; later ones
+        # reuse the session, which reconnects by itself if it was dropped.
+        key, entry = self._entry(sender_email, sender_password, host, port, starttls)
+        with entry.lock:
+            session = entry.session
+            session.metrics = metrics
+            try:
+                return session.send(sender_email, recipients, message)
+            finally:
+                session.metrics = None
+                entry.used = time.monotonic()
+                if session.server is None:
+                    # Login failed or the server is unreachable: start over next time
+                    self._evict(key, entry)
+
+    def _evict(self, key, entry):
+        entry.session.close()
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def _maintain(self):
+        while not self._stop.wait(self.keepalive):
+            with self._lock:
+                entries = list(self._entries.items())
+            for key, entry in entries:
+                # Sessions busy sending are left alone
+                if not entry.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if time.monotonic() - entry.used >= self.idle:
+                        self._evict(key, entry)
+                    elif entry.session.connected:
+                        try:
+                            entry.session.server.noop()
+                        except Exception:
+                            entry.session.close()
+                finally:
+                    entry.lock.release()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        for entry in entries.values():
+            with entry.lock:
+                entry.session.close()
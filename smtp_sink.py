@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import random
+import threading
+import time
+
+# Local stand-in SMTP server for benchmarks and dry runs. It accepts any
+# login, throws the messages away and can simulate network latency,
+# provider throttling and recipient errors. Plain TCP only: connect with
+# starttls=False.
+
+BANNER = b'220 localhost ESMTP mail sink\r\n'
+STREAM_LIMIT = 1 << 26
+READ_BLOCK = 1 << 16
+
+
+class SinkStats:
+    def __init__(self):
+        self.connections = 0
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.throttled = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self):
+        with self._lock:
+            return {name: getattr(self, name) for name in
+                    ('connections', 'messages', 'recipients', 'bytes', 'throttled', 'rejected')}
+
+
+class SMTPSink:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, throttle_rate=None,
+                 error_rate=0.0, throttle_code=451, seed=None, domain_rate=None, hangup_recipients=None):
+        # latency: seconds added before every reply (one simulated RTT).
+        # throttle_rate: messages/second the sink accepts before answering
+        # MAIL FROM with throttle_code (451, or 421 which also hangs up).
+        # error_rate: probability that a RCPT TO is refused with 550.
+        # domain_rate: recipients/second accepted per recipient domain before
+        # RCPT TO is deferred with 451, like a receiving domain pushing back.
+        # hangup_recipients: address -> how many times a RCPT TO for it is
+        # answered with 421 and the connection closed.
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.throttle_code = throttle_code
+        self.error_rate = error_rate
+        self.stats = SinkStats()
+        self._random = random.Random(seed)
+        self._tokens = float(throttle_rate or 0)
+        self._last = time.monotonic()
+        self.domain_rate = domain_rate
+        self._domains = {}
+        self.hangup_recipients = dict(hangup_recipients or {})
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def _allow(self):
+        if not self.throttle_rate:
+            return True
+        now = time.monotonic()
+        self._tokens = min(float(self.throttle_rate), self._tokens + (now - self._last) * self.throttle_rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _allow_domain(self, line):
+        if not self.domain_rate:
+            return True
+        domain = line.rpartition(b'@')[2].strip().rstrip(b'>').lower()
+        now = time.monotonic()
+        tokens, last = self._domains.get(domain, (float(self.domain_rate), now))
+        tokens = min(float(self.domain_rate), tokens + (now - last) * self.domain_rate)
+        allowed = tokens >= 1
+        self._domains[domain] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+    def _hang_up(self, line):
+        address = line.partition(b':')[2].strip().strip(b'<>').decode('ascii', 'replace').lower()
+        remaining = self.hangup_recipients.get(address, 0)
+        if remaining <= 0:
+            return False
+        self.hangup_recipients[address] = remaining - 1
+        return True
+
+    async def _reply(self, writer, line):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(line)
+        await writer.drain()
+
+    async def _discard_data(self, reader):
+        # Reads the DATA payload in blocks up to the terminating dot line
+        # without keeping it, so the sink's memory stays flat whatever the
+        # message size. Returns the payload size.
+        size = 0
+        tail = b''
+        while True:
+            block = await reader.read(READ_BLOCK)
+            if not block:
+                raise asyncio.IncompleteReadError(tail, None)
+            size += len(block)
+            window = tail + block
+            if window.endswith(b'\r\n.\r\n') or window == b'.\r\n':
+                return size
+            tail = window[-4:]
+
+    async def _handle(self, reader, writer):
+        self.stats.add(connections=1)
+        recipients = 0
+        try:
+            writer.write(BANNER)
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line[:4].upper()
+                if command == b'EHLO':
+                    await self._reply(writer, b'250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n'
+                                              b'250-PIPELINING\r\n250 SIZE 104857600\r\n')
+                elif command == b'HELO':
+                    await self._reply(writer, b'250 localhost\r\n')
+                elif command == b'AUTH':
+                    if line[5:].strip().upper().startswith(b'LOGIN') and len(line.split()) == 2:
+                        await self._reply(writer, b'334 VXNlcm5hbWU6\r\n')
+                        await reader.readline()
+                        await self._reply(writer, b'334 UGFzc3dvcmQ6\r\n')
+                        await reader.readline()
+                    await self._reply(writer, b'235 2.7.0 Authentication successful\r\n')
+                elif command == b'MAIL':
+                    recipients = 0
+                    if self._allow():
+                        await self._reply(writer, b'250 2.1.0 OK\r\n')
+                    else:
+                        self.stats.add(throttled=1)
+                        await self._reply(writer, b'%d 4.7.0 Try again later\r\n' % self.throttle_code)
+                        if self.throttle_code == 421:
+                            break
+                elif command == b'RCPT':
+                    if self._hang_up(line):
+                        self.stats.add(throttled=1)
+                        await self._reply(writer, b'421 4.7.0 Closing connection\r\n')
+                        break
+                    if self.error_rate and self._random.random() < self.error_rate:
+                        self.stats.add(rejected=1)
+                        await self._reply(writer, b'550 5.1.1 No such user\r\n')
+                    elif not self._allow_domain(line):
+                        self.stats.add(throttled=1)
+                        await self._reply(writer, b'451 4.7.1 Too many messages for this domain, try again later\r\n')
+                    else:
+                        recipients += 1
+                        await self._reply(writer, b'250 2.1.5 OK\r\n')
+                elif command == b'DATA':
+                    await self._reply(writer, b'354 Go ahead\r\n')
+                    size = await self._discard_data(reader)
+                    self.stats.add(messages=1, recipients=recipients, bytes=size)
+                    await self._reply(writer, b'250 2.0.0 OK queued\r\n')
+                elif command in (b'RSET', b'NOOP'):
+                    recipients = 0 if command == b'RSET' else recipients
+                    await self._reply(writer, b'250 2.0.0 OK\r\n')
+                elif command == b'QUIT':
+                    await self._reply(writer, b'221 2.0.0 Bye\r\n')
+                    break
+                elif command == b'STAR':
+                    await self._reply(writer, b'454 4.7.0 TLS not available\r\n')
+                else:
+                    await self._reply(writer, b'502 5.5.2 Command not recognized\r\n')
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=STREAM_LIMIT)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    def start(self):
+        # Serves on a background thread; returns once the port is bound.
+        self._thread = threading.Thread(target=self._run, name='smtp-sink', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local SMTP sink that accepts and discards mail.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added before every reply")
+    parser.add_argument("--throttle-rate", type=float, default=None, help="messages/second before 4xx replies")
+    parser.add_argument("--throttle-code", type=int, default=451, choices=(421, 451))
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a 550 on RCPT TO")
+    parser.add_argument("--domain-rate", type=float, default=None,
+                        help="recipients/second per recipient domain before 451 on RCPT TO")
+    args = parser.parse_args(argv)
+    sink = SMTPSink(args.host, args.port, args.latency, args.throttle_rate, args.error_rate, args.throttle_code,
+                    domain_rate=args.domain_rate)
+    sink.start()
+    print(f"SMTP sink listening on {sink.host}:{sink.port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(5)
+            print(sink.stats.to_dict())
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import json
+import mmap
+import os
+import socket
+import struct
+import time
+
+# On-disk message spool. A campaign can be rendered to a spool at disk speed
+# with no network (which doubles as a dry run that can be inspected), and a
+# separate drain step later streams the stored bytes to SMTP.
+#
+# Two formats:
+#   maildir  one file per message under new/, plus a tab-separated index
+#            (file name, row key, recipient) and spool.json with metadata.
+#            Messages keep their CRLF wire line endings.
+#   bulk     a single file: MAGIC, a length-prefixed JSON metadata block,
+#            then one record per message (key/recipient/message lengths,
+#            followed by the three byte strings). Read back through mmap.
+
+MAILDIR = 'maildir'
+BULK = 'bulk'
+FORMATS = (MAILDIR, BULK)
+
+MAGIC = b'MAILSPOOL1\n'
+LENGTH = struct.Struct('>I')
+RECORD = struct.Struct('>III')
+INDEX_NAME = 'index'
+METADATA_NAME = 'spool.json'
+WRITE_BUFFER = 1 << 20
+DRAIN_BATCH = 500
+
+
+class SpoolError(ValueError):
+    pass
+
+
+def write_message(f, message):
+    # bytes, or a message_builder.StreamedMessage copied block by block.
+    if isinstance(message, bytes):
+        f.write(message)
+        return
+    for chunk in message.chunks():
+        f.write(chunk)
+
+
+class BulkSpoolWriter:
+    def __init__(self, path, metadata):
+        # Written to a temporary name and moved into place on close, so a
+        # half-written spool is never drained.
+        self.path = path
+        self.metadata = metadata
+        self.count = 0
+        self._partial = path + '.partial'
+        self._file = open(self._partial, 'wb', buffering=WRITE_BUFFER)
+        header = json.dumps(metadata).encode('utf-8')
+        self._file.write(MAGIC + LENGTH.pack(len(header)) + header)
+
+    def add(self, key, recipient, message):
+        key = str(key).encode('utf-8')
+        recipient = str(recipient).encode('utf-8')
+        self._file.write(RECORD.pack(len(key), len(recipient), len(message)))
+        self._file.write(key)
+        self._file.write(recipient)
+        write_message(self._file, message)
+        self.count += 1
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.replace(self._partial, self.path)
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self._partial):
+            os.remove(self._partial)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class BulkSpoolReader:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SpoolError(f"{path} is empty")
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise SpoolError(f"{path} is not a bulk spool file")
+        offset = len(MAGIC)
+        (size,) = LENGTH.unpack_from(self._map, offset)
+        offset += LENGTH.size
+        self.metadata = json.loads(self._map[offset:offset + size].decode('utf-8'))
+        self._start = offset + size
+
+    def __iter__(self):
+        # Yields (row key, recipient, message bytes). Each message is sliced
+        # straight out of the mapping, so the file is never read as a whole.
+        data = self._map
+        offset = self._start
+        end = len(data)
+        while offset < end:
+            key_size, recipient_size, message_size = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            key = data[offset:offset + key_size].decode('utf-8')
+            offset += key_size
+            recipient = data[offset:offset + recipient_size].decode('utf-8')
+            offset += recipient_size
+            if offset + message_size > end:
+                raise SpoolError(f"{self.path} is truncated")
+            yield key, recipient, data[offset:offset + message_size]
+            offset += message_size
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MaildirSpoolWriter:
+    def __init__(self, path, metadata):
+        # Writing to an existing spool replaces it. The metadata only lands
+        # on close, so a spool that was cut short cannot be drained.
+        self.path = path
+        self.metadata = metadata
+        self.count = 0
+        if os.path.isdir(path) and not os.path.exists(os.path.join(path, METADATA_NAME)) and os.listdir(path):
+            raise SpoolError(f"{path} exists and is not a message spool")
+        self._clear()
+        for sub in ('tmp', 'new', 'cur'):
+            os.makedirs(os.path.join(path, sub), exist_ok=True)
+        self._suffix = f"{os.getpid()}.{socket.gethostname().replace('/', '_').replace(':', '_')}"
+        self._stamp = int(time.time())
+        self._index = open(os.path.join(path, INDEX_NAME), 'w', encoding='utf-8')
+
+    def _clear(self):
+        for name in (METADATA_NAME, INDEX_NAME):
+            if os.path.exists(os.path.join(self.path, name)):
+                os.remove(os.path.join(self.path, name))
+        for sub in ('tmp', 'new', 'cur'):
+            directory = os.path.join(self.path, sub)
+            if os.path.isdir(directory):
+                for entry in os.scandir(directory):
+                    os.remove(entry.path)
+
+    def add(self, key, recipient, message):
+        # Maildir delivery: write under tmp/, then rename into new/.
+        name = f"{self._stamp}.{self.count:09d}.{self._suffix}"
+        partial = os.path.join(self.path, 'tmp', name)
+        with open(partial, 'wb') as f:
+            write_message(f, message)
+        os.rename(partial, os.path.join(self.path, 'new', name))
+        self._index.write(f"{name}\t{key}\t{recipient}\n")
+        self.count += 1
+
+    def close(self):
+        if self._index is None:
+            return
+        self._index.close()
+        self._index = None
+        with open(os.path.join(self.path, METADATA_NAME), 'w', encoding='utf-8') as f:
+            json.dump(self.metadata, f)
+
+    def discard(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        self._clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class MaildirSpoolReader:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(os.path.join(path, METADATA_NAME), encoding='utf-8') as f:
+                self.metadata = json.load(f)
+        except FileNotFoundError:
+            raise SpoolError(f"{path} is not a complete message spool")
+
+    def __iter__(self):
+        # Index order is render order; messages moved or deleted from new/
+        # since the spool was written are skipped.
+        with open(os.path.join(self.path, INDEX_NAME), encoding='utf-8') as index:
+            for line in index:
+                name, key, recipient = line.rstrip('\n').split('\t', 2)
+                try:
+                    with open(os.path.join(self.path, 'new', name), 'rb') as f:
+                        message = f.read()
+                except FileNotFoundError:
+                    continue
+                yield key, recipient, message
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def create_spool(path, fmt=MAILDIR, **metadata):
+    # metadata (campaign id, sender, ...) is stored with the spool and used
+    # by the drain step.
+    metadata = dict(metadata, format=fmt, created=time.time())
+    if fmt == MAILDIR:
+        return MaildirSpoolWriter(path, metadata)
+    if fmt == BULK:
+        return BulkSpoolWriter(path, metadata)
+    raise SpoolError(f"unknown spool format {fmt!r}; use one of {', '.join(FORMATS)}")
+
+
+def open_spool(path):
+    if os.path.isdir(path):
+        return MaildirSpoolReader(path)
+    return BulkSpoolReader(path)
+
+
+class SpoolDrain:
+    """Sends a spool through a SendEngine.
+
+    Mirrors campaign.Campaign.run: rows the journal already has as sent are
+    skipped, the quota is applied and every result is journaled under the
+    campaign id stored with the spool.
+    """
+
+    def __init__(self, spool, journal=None, already_sent=None, quota=None):
+        self.spool = spool
+        self.campaign_id = spool.metadata.get('campaign')
+        self.sender_email = spool.metadata.get('sender')
+        self.journal = journal
+        self.already_sent = already_sent or set()
+        self.quota = quota
+        self.skipped = 0
+        self.queued = 0
+        self._seen = set()
+
+    def _select(self, batch):
+        # A row key is sent once per drain, even if the spool holds it twice.
+        pending = []
+        for item in batch:
+            if item[0] in self.already_sent or item[0] in self._seen:
+                continue
+            self._seen.add(item[0])
+            pending.append(item)
+        self.skipped += len(batch) - len(pending)
+        batch = pending
+        if self.quota is not None:
+            batch = batch[:self.quota.take(len(batch))]
+        if batch and self.journal is not None:
+            self.journal.mark_queued(self.campaign_id, [(key, recipient) for key, recipient, _ in batch])
+        self.queued += len(batch)
+        return batch
+
+    def messages(self):
+        batch = []
+        for item in self.spool:
+            batch.append(item)
+            if len(batch) < DRAIN_BATCH:
+                continue
+            yield from self._select(batch)
+            batch = []
+            if self.quota is not None and self.quota.exhausted:
+                return
+        if batch:
+            yield from self._select(batch)
+
+    def run(self, engine, on_result=None, checkpoint=None):
+        # engine must already be open.
+        if self.journal is not None:
+            self.journal.register(self.campaign_id, self.sender_email)
+
+        def handle(result):
+            if self.journal is not None:
+                self.journal.record(self.campaign_id, result)
+            if on_result is not None:
+                on_result(result)
+
+        return engine.send_all(self.messages(), on_result=handle, checkpoint=checkpoint)
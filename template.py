@@ -0,0 +1,102 @@
+import re
+
+# Compiled {variable} templates. The text is scanned once into a
+# TemplateIndex of its placeholders; binding the index to a column mapping
+# gives a CompiledTemplate of alternating literal text and column
+# references, so each row renders in a single pass and columns the template
+# never mentions are never touched. A changed mapping only re-binds the
+# index, the text is not scanned again.
+
+PLACEHOLDER = re.compile(r'\{([^{}]*)\}')
+
+
+class TemplateIndex:
+    def __init__(self, text):
+        # literals[i] comes before placeholder i; names[i] is its variable,
+        # the last literal follows the last placeholder.
+        self.text = text
+        self.literals = []
+        self.names = []
+        pos = 0
+        for match in PLACEHOLDER.finditer(text):
+            self.literals.append(text[pos:match.start()])
+            self.names.append(match.group(1))
+            pos = match.end()
+        self.literals.append(text[pos:])
+
+    @property
+    def variables(self):
+        # Every placeholder name once, in order of first use; blank ones
+        # like "{}" are plain text.
+        return list(dict.fromkeys(name for name in self.names if name.strip()))
+
+    def bind(self, memo):
+        return CompiledTemplate(self.text, memo, index=self)
+
+
+class CompiledTemplate:
+    def __init__(self, text, memo, index=None):
+        # memo maps CSV column -> template variable, as built by the mapping
+        # step. When two columns share a variable the first one wins.
+        # Placeholders without a mapped column stay in the text as typed.
+        columns_by_var = {}
+        for csv_col, template_var in memo.items():
+            if template_var and template_var not in columns_by_var:
+                columns_by_var[template_var] = csv_col
+
+        index = index or TemplateIndex(text)
+        self.text = text
+        self.literals = []
+        self.columns = []
+        self.variables = []
+        pending = index.literals[0]
+        for name, literal in zip(index.names, index.literals[1:]):
+            if name not in columns_by_var:
+                pending += '{' + name + '}' + literal
+                continue
+            self.literals.append(pending)
+            self.columns.append(columns_by_var[name])
+            if name not in self.variables:
+                self.variables.append(name)
+            pending = literal
+        self.literals.append(pending)
+
+    @property
+    def is_static(self):
+        return not self.columns
+
+    def render(self, row):
+        # row is anything indexable by column name (Series, dict, namedtuple
+        # via _asdict()).
+        if not self.columns:
+            return self.literals[0]
+        parts = [self.literals[0]]
+        for column, literal in zip(self.columns, self.literals[1:]):
+            parts.append(str(row[column]))
+            parts.append(literal)
+        return ''.join(parts)
+
+    def render_batch(self, batch):
+        # One string per recipient of a recipients.RecipientBatch. The
+        # literals become a format string, so each row is a single
+        # str.format call over the field lists.
+        if not self.columns:
+            return [self.literals[0]] * len(batch)
+        pattern = '{}'.join(literal.replace('{', '{{').replace('}', '}}') for literal in self.literals)
+        return list(map(pattern.format, *(batch[column] for column in self.columns)))
+
+
+def compile_template(text, memo):
+    return CompiledTemplate(text or '', memo)
+
+
+def check_mapping(memo, *indexes):
+    # (unknown, unused): placeholders of the TemplateIndexes that no column
+    # is mapped to, and mapped variables none of them uses.
+    mapped = [variable for variable in dict.fromkeys(memo.values()) if variable]
+    used = []
+    for index in indexes:
+        used.extend(variable for variable in index.variables if variable not in used)
+    unknown = [variable for variable in used if variable not in mapped]
+    unused = [variable for variable in mapped if variable not in used]
+    return unknown, unused
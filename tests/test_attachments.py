@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attachments import AttachmentCache, release
+
+
+def test_pinned_part_survives_eviction_until_released(tmp_path):
+    cache = AttachmentCache(str(tmp_path), max_bytes=1)
+    queued = cache.add('first.pdf', b'a' * 1000, pin=True)
+    cache.add('second.pdf', b'b' * 1000)
+    assert os.path.exists(queued.path)
+    release([queued])
+    cache.add('third.pdf', b'c' * 1000)
+    assert not os.path.exists(queued.path)
+
+
+def test_part_pinned_twice_needs_two_releases(tmp_path):
+    cache = AttachmentCache(str(tmp_path), max_bytes=1)
+    first = cache.add('same.pdf', b'a' * 1000, pin=True)
+    second = cache.add('same.pdf', b'a' * 1000, pin=True)
+    release([first])
+    cache.add('other.pdf', b'b' * 1000)
+    assert os.path.exists(second.path)
+    release([second])
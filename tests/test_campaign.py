@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from campaign import Campaign
+from journal import SendJournal
+from message_builder import MessageBuilder
+from send_engine import SendEngine
+from smtp_sink import SMTPSink
+from template import compile_template
+
+MEMO = {'email': '', 'name': 'name'}
+
+
+def recipients(names):
+    return pd.DataFrame({'email': [f'user{i}@x.com' for i in range(len(names))], 'name': names})
+
+
+def campaign(journal=None, already_sent=None):
+    return Campaign('me@x.com', 'email', compile_template('Hi {name}', MEMO), compile_template('Hello {name}', MEMO),
+                    MessageBuilder('me@x.com'), campaign_id='c', journal=journal, already_sent=already_sent)
+
+
+def run(bulk, frame, render_workers=1):
+    with SMTPSink() as sink:
+        with SendEngine('me@x.com', 'pw', connections=2, host=sink.host, port=sink.port, starttls=False) as engine:
+            results = bulk.run(engine, [frame], render_workers=render_workers)
+    return sink, results
+
+
+@pytest.mark.parametrize('render_workers', [1, 2])
+def test_row_that_cannot_be_built_fails_alone(tmp_path, render_workers):
+    journal = SendJournal(str(tmp_path / 'journal.sqlite3'))
+    sink, results = run(campaign(journal), recipients(['A', 'B\nCc: z@evil.com', 'C']), render_workers)
+    outcome = {result.index: result.ok for result in results}
+    assert outcome == {0: True, 1: False, 2: True}
+    assert sink.stats.messages == 2
+    assert journal.summary('c') == {'queued': 0, 'sent': 2, 'failed': 1}
+    journal.close()
+
+
+def test_resume_skips_rows_already_sent(tmp_path):
+    journal = SendJournal(str(tmp_path / 'journal.sqlite3'))
+    journal.register('c', 'me@x.com')
+    journal.mark_queued('c', [(0, 'user0@x.com'), (1, 'user1@x.com'), (2, 'user2@x.com')])
+    journal.mark_sent('c', 0, 'user0@x.com')
+    journal.mark_failed('c', 1, 'user1@x.com', 'timed out')
+    journal.mark_sent('c', 2, 'user2@x.com')
+    bulk = campaign(journal, already_sent=journal.completed('c'))
+    sink, results = run(bulk, recipients(['A', 'B', 'C', 'D']))
+    assert sorted(result.index for result in results) == [1, 3]
+    assert bulk.skipped == 2
+    assert sink.stats.recipients == 2
+    assert journal.completed('c') == {'0', '1', '2', '3'}
+    journal.close()
+
+
+def test_finished_campaign_sends_nothing_again(tmp_path):
+    journal = SendJournal(str(tmp_path / 'journal.sqlite3'))
+    run(campaign(journal), recipients(['A', 'B']))
+    sink, results = run(campaign(journal, already_sent=journal.completed('c')), recipients(['A', 'B']))
+    assert results == []
+    assert sink.stats.messages == 0
+    journal.close()
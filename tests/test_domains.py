@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from domains import DomainLimiter
+
+
+def test_no_concurrency_cap_by_default():
+    limiter = DomainLimiter()
+    for _ in range(10):
+        limiter.acquire(['gmail.com'])
+    assert limiter.ready(['gmail.com'])
+
+
+def test_deferral_pauses_only_that_domain():
+    limiter = DomainLimiter(cooldown=30)
+    limiter.on_throttle(['gmail.com'])
+    assert not limiter.ready(['gmail.com'])
+    assert limiter.ready(['example.com'])
+
+
+def test_cap_holds_back_a_busy_domain():
+    limiter = DomainLimiter(per_domain=2)
+    limiter.acquire(['gmail.com'])
+    limiter.acquire(['gmail.com'])
+    assert not limiter.ready(['gmail.com'])
+    limiter.release(['gmail.com'])
+    assert limiter.ready(['gmail.com'])
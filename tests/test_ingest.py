@@ -0,0 +1,33 @@
+import io
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest
+
+
+def test_xlsx_rows_numbered_as_read_excel(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    path = str(tmp_path / 'recipients.xlsx')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in (['email', 'name'], ['a@x.com', 'A'], [None, None], [None, None], ['b@x.com', 'B'],
+                [None, None]):
+        sheet.append(row)
+    workbook.save(path)
+    chunks = list(ingest._iter_xlsx(path, chunksize=2))
+    pd.testing.assert_frame_equal(pd.concat(chunks), pd.read_excel(path))
+
+
+def test_cache_keyed_by_file_kind(tmp_path):
+    pytest.importorskip('pyarrow')
+    data = io.BytesIO(b'email\tname\na@x.com,b@x.com\tA\n')
+    digest = ingest.content_digest(data)
+    as_csv = ingest.cached_table(data, 'list.csv', digest, directory=str(tmp_path))
+    as_tsv = ingest.cached_table(data, 'list.tsv', digest, directory=str(tmp_path))
+    assert as_csv != as_tsv
+    assert pd.read_parquet(as_tsv).columns.tolist() == ['email', 'name']
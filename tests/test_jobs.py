@@ -0,0 +1,29 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import CANCELLED, DONE, JobManager
+
+
+def test_on_finish_runs_for_finished_and_cancelled_jobs():
+    manager = JobManager()
+    started = threading.Event()
+    go = threading.Event()
+    finished = []
+
+    def run(job):
+        started.set()
+        go.wait(5)
+
+    first = manager.submit('first', run, on_finish=lambda: finished.append('first'))
+    started.wait(5)
+    second = manager.submit('second', run, on_finish=lambda: finished.append('second'))
+    second.cancel()
+    go.set()
+    done = threading.Event()
+    manager.submit('last', lambda job: None, on_finish=done.set)
+    assert done.wait(5)
+    assert (first.state, second.state) == (DONE, CANCELLED)
+    assert finished == ['first', 'second']
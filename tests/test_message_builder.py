@@ -0,0 +1,58 @@
+import email
+import email.policy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attachments import AttachmentCache
+from message_builder import MessageBuilder
+
+
+def attachments_of(raw):
+    message = email.message_from_bytes(raw)
+    return [(part.get_filename(), part.get_payload(decode=True)) for part in message.walk()
+            if part.get_content_disposition() == 'attachment']
+
+
+@pytest.mark.parametrize('filename', ['résumé.pdf', 'r é.pdf', 'report.pdf'])
+def test_attachment_filenames_in_memory(filename):
+    builder = MessageBuilder('s@x.com', [(filename, b'data')])
+    assert attachments_of(builder.build('r@x.com', 'Hi', 'Body')) == [(filename, b'data')]
+
+
+@pytest.mark.parametrize('filename', ['résumé.pdf', 'r é.pdf', 'report.pdf'])
+def test_attachment_filenames_on_disk(tmp_path, filename):
+    cache = AttachmentCache(str(tmp_path))
+    builder = MessageBuilder('s@x.com', [cache.add(filename, b'data')])
+    message = builder.build('r@x.com', 'Hi', 'Body')
+    assert attachments_of(message.to_bytes()) == [(filename, b'data')]
+
+
+@pytest.mark.parametrize('subject', ['Hello Ann', 'Grüße aus Köln', 'x' * 200])
+def test_built_message_parses_back(subject):
+    builder = MessageBuilder('Me <me@x.com>', [('report.pdf', b'%PDF' * 100)])
+    body = 'Hi Ann,\n\nünicode body\n.leading dot\n'
+    message = email.message_from_bytes(builder.build('ann@x.com', subject, body), policy=email.policy.default)
+    assert message['From'] == 'Me <me@x.com>'
+    assert message['To'] == 'ann@x.com'
+    assert message['Subject'] == subject
+    assert message.get_content_type() == 'multipart/mixed'
+    text, attachment = message.iter_parts()
+    assert text.get_content() == body
+    assert attachment.get_filename() == 'report.pdf'
+    assert attachment.get_content() == b'%PDF' * 100
+
+
+def test_streamed_message_matches_in_memory(tmp_path):
+    data = os.urandom(100000)
+    in_memory = MessageBuilder('me@x.com', [('a.bin', data)])
+    on_disk = MessageBuilder('me@x.com', [AttachmentCache(str(tmp_path)).add('a.bin', data)])
+    on_disk.boundary = in_memory.boundary
+    expected = in_memory.build('ann@x.com', 'Hi', 'Body')
+    streamed = on_disk.build('ann@x.com', 'Hi', 'Body')
+    assert len(streamed) == len(streamed.to_bytes())
+    assert email.message_from_bytes(streamed.to_bytes()).get_payload(1).get_payload(decode=True) == data
+    assert len(streamed.to_bytes()) == len(expected)
@@ -0,0 +1,61 @@
+import os
+import smtplib
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limit import AdaptiveRateLimiter, is_temporary
+from send_engine import SendEngine
+from smtp_sink import SMTPSink
+
+
+def test_temporary_failures():
+    assert is_temporary(smtplib.SMTPServerDisconnected('gone'))
+    assert is_temporary(smtplib.SMTPSenderRefused(451, b'try later', 'me@x.com'))
+    assert is_temporary(smtplib.SMTPRecipientsRefused({'a@x.com': (452, b'too many')}))
+    assert not is_temporary(smtplib.SMTPRecipientsRefused({'a@x.com': (452, b''), 'b@x.com': (550, b'')}))
+    assert not is_temporary(smtplib.SMTPDataError(554, b'rejected'))
+    assert not is_temporary(smtplib.SMTPAuthenticationError(535, b'bad login'))
+
+
+def test_throttle_halves_rate_and_pauses():
+    limiter = AdaptiveRateLimiter(max_rate=10, cooldown=0.2)
+    limiter.on_throttle()
+    assert limiter.rate == 5
+    assert limiter.paused
+    started = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - started >= 0.15
+    assert limiter.throttles == 1
+
+
+def test_repeated_throttles_grow_the_pause_down_to_min_rate():
+    limiter = AdaptiveRateLimiter(max_rate=1, min_rate=0.2, cooldown=0.01)
+    for _ in range(5):
+        limiter.on_throttle()
+        time.sleep(0.01 * 2 ** 4 + 0.01)
+    assert limiter.rate == 0.2
+    limiter.on_throttle()
+    assert limiter._paused_until - time.monotonic() > 0.01 * 2 ** 4
+
+
+def test_success_climbs_back_to_max_rate():
+    limiter = AdaptiveRateLimiter(max_rate=2, increase=0.5, cooldown=0.01)
+    limiter.on_throttle()
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.rate == 2
+
+
+def test_engine_backs_off_on_4xx_and_recovers():
+    limiter = AdaptiveRateLimiter(max_rate=1000, cooldown=0.05)
+    with SMTPSink(throttle_rate=50) as sink:
+        with SendEngine('me@x.com', 'pw', connections=2, host=sink.host, port=sink.port, starttls=False,
+                        limiter=limiter, retries=10) as engine:
+            jobs = [(i, f'user{i}@x.com', b'Subject: hi\r\n\r\nbody\r\n') for i in range(100)]
+            results = engine.send_all(jobs)
+    assert all(result.ok for result in results)
+    assert sink.stats.throttled > 0
+    assert limiter.throttles > 0
+    assert limiter.rate > limiter.min_rate
@@ -0,0 +1,85 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import send_engine
+from jobs import SendJob
+from send_engine import SendEngine
+from smtp_sink import SMTPSink
+
+MESSAGE = b"Subject: test\r\n\r\nHello\r\n"
+RECIPIENTS = ['a@x.com', 'b@x.com', 'c@x.com', 'd@x.com']
+
+
+@pytest.fixture(autouse=True)
+def no_reconnect_delay(monkeypatch):
+    monkeypatch.setattr(send_engine, 'RECONNECT_DELAY', 0.0)
+
+
+def send_batch(sink, retries=3):
+    engine = SendEngine('me@x.com', 'pw', connections=1, host=sink.host, port=sink.port, starttls=False,
+                        retries=retries)
+    with engine:
+        return engine.send_batch([0, 1, 2, 3], RECIPIENTS, MESSAGE)
+
+
+def test_batch_resent_after_421_during_rcpt():
+    with SMTPSink(hangup_recipients={'b@x.com': 1}) as sink:
+        results = send_batch(sink)
+    assert [result.ok for result in results] == [True] * 4
+    assert sink.stats.messages == 1
+    assert sink.stats.recipients == 4
+
+
+def test_batch_fails_whole_when_server_keeps_hanging_up():
+    with SMTPSink(hangup_recipients={'b@x.com': 100}) as sink:
+        results = send_batch(sink, retries=0)
+    assert sorted(result.recipient for result in results) == RECIPIENTS
+    assert not any(result.ok for result in results)
+    assert all(result.sender_failed for result in results)
+    assert sink.stats.messages == 0
+
+
+def test_pause_collects_results_already_in_flight():
+    job = SendJob(1, 'test', None)
+    results = []
+    submitted = []
+    seen_while_paused = []
+
+    def jobs():
+        for i in range(20):
+            submitted.append(i)
+            yield i, f'user{i}@x.com', MESSAGE
+
+    def check_and_resume():
+        seen_while_paused.append((len(results), len(submitted)))
+        job.resume()
+
+    def on_result(result):
+        results.append(result)
+        if len(results) == 3:
+            job.pause()
+            threading.Timer(0.5, check_and_resume).start()
+
+    with SMTPSink(latency=0.01) as sink:
+        engine = SendEngine('me@x.com', 'pw', connections=4, host=sink.host, port=sink.port, starttls=False)
+        with engine:
+            engine.send_all(jobs(), on_result=on_result, checkpoint=job.checkpoint)
+    assert len(results) == 20
+    received, sent = seen_while_paused[0]
+    assert received == sent
+
+
+def test_dead_connection_reopened_without_waiting(monkeypatch):
+    monkeypatch.setattr(send_engine, 'RECONNECT_DELAY', 5.0)
+    with SMTPSink(hangup_recipients={'b@x.com': 1}) as sink:
+        started = time.monotonic()
+        results = send_batch(sink)
+        elapsed = time.monotonic() - started
+    assert all(result.ok for result in results)
+    assert elapsed < 2
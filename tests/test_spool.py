@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spool import BULK, FORMATS, MAILDIR, SpoolDrain, SpoolError, create_spool, open_spool
+
+
+def write(path, fmt, rows):
+    with create_spool(path, fmt, campaign='c', sender='me@x.com') as writer:
+        for key in rows:
+            writer.add(key, f'user{key}@x.com', b'Subject: hi\r\n\r\nbody\r\n')
+    return writer
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_writing_again_replaces_the_spool(tmp_path, fmt):
+    path = str(tmp_path / f'campaign.{fmt}')
+    write(path, fmt, range(4))
+    write(path, fmt, range(4))
+    spool = open_spool(path)
+    try:
+        assert [key for key, _, _ in spool] == ['0', '1', '2', '3']
+    finally:
+        spool.close()
+
+
+def test_drain_sends_each_row_key_once(tmp_path):
+    path = str(tmp_path / 'campaign.bulk')
+    write(path, BULK, ['0', '1', '1', '2'])
+    spool = open_spool(path)
+    try:
+        drain = SpoolDrain(spool)
+        assert [key for key, _, _ in drain.messages()] == ['0', '1', '2']
+        assert drain.skipped == 1
+    finally:
+        spool.close()
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_discarded_spool_cannot_be_drained(tmp_path, fmt):
+    path = str(tmp_path / f'campaign.{fmt}')
+    writer = create_spool(path, fmt, campaign='c', sender='me@x.com')
+    writer.add('0', 'a@x.com', b'body')
+    writer.discard()
+    writer.close()
+    with pytest.raises((SpoolError, FileNotFoundError)):
+        open_spool(path)
+    if fmt == MAILDIR:
+        assert not os.listdir(os.path.join(path, 'new'))
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recipients import RecipientBatch
+from template import TemplateIndex, compile_template
+
+MEMO = {'email': '', 'name': 'name', 'company': 'company', 'city': 'name'}
+ROWS = pd.DataFrame({'email': ['a@x.com', 'b@x.com'], 'name': ['Ann', 'Bob'],
+                     'company': ['Acme', 'Co {x}'], 'city': ['Oslo', 'Rome']})
+TEXTS = [
+    'Hello {name} from {company}!',
+    'No variables at all',
+    'Unmapped {x} and {email} stay',
+    'Empty {} braces, { name } with spaces',
+    'Doubled {{name}} and {{x}}',
+    '{name}{name}{company}',
+    'Stray } and { around {name}',
+    '',
+]
+
+
+def replaced(text, memo, row):
+    # How templates were filled in before they were compiled
+    for csv_col, template_var in memo.items():
+        if template_var:
+            text = text.replace(f'{{{template_var}}}', str(row[csv_col]))
+    return text
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_render_matches_str_replace(text):
+    template = compile_template(text, MEMO)
+    batch = RecipientBatch.from_frame(ROWS, 'email', ['email'] + template.columns)
+    expected = [replaced(text, MEMO, row) for _, row in ROWS.iterrows()]
+    assert [template.render(row) for _, row in ROWS.iterrows()] == expected
+    assert template.render_batch(batch) == expected
+
+
+def test_rebinding_an_index_gives_the_same_template():
+    index = TemplateIndex(TEXTS[0])
+    other = {'email': '', 'name': 'company', 'company': 'name'}
+    row = ROWS.iloc[0]
+    assert index.bind(other).render(row) == compile_template(TEXTS[0], other).render(row) == 'Hello Acme from Ann!'
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation import DUPLICATE, INVALID, RecipientValidator
+
+
+def validate(cells, **options):
+    validator = RecipientValidator('email', **options)
+    valid = validator.apply(pd.DataFrame({'email': cells}))
+    return valid['email'].to_dict(), validator
+
+
+def test_separator_inside_display_name_does_not_split():
+    valid, validator = validate(['"Doe, John" <John@X.com>'])
+    assert valid == {0: 'john@x.com'}
+    assert validator.valid == 1
+
+
+def test_cells_with_several_addresses_are_split():
+    valid, _ = validate(['a@b.com; Smith <s@y.org>, t@z.net'])
+    assert valid == {'0': 'a@b.com', '0/2': 's@y.org', '0/3': 't@z.net'}
+
+
+def test_punycode_top_level_domain_is_valid():
+    valid, validator = validate(['x@mail.xn--p1ai', 'y@tld.x-y'])
+    assert valid == {0: 'x@mail.xn--p1ai'}
+    assert validator.rejected['reason'].tolist() == [INVALID]
+
+
+def test_duplicates_keep_the_first_row():
+    valid, validator = validate(['a@b.com', ' A@B.com '])
+    assert valid == {0: 'a@b.com'}
+    assert validator.rejected['reason'].tolist() == [DUPLICATE]
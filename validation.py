@@ -0,0 +1,208 @@
+# Column-wise validation of the recipient column. Each chunk goes through
+# pandas string operations over the whole column: cells holding several
+# addresses are split into one row each, addresses are trimmed, unwrapped
+# from "Name <address>" and lowercased, checked against a syntax pattern and
+# the suppression list, and duplicates are dropped. Rejected rows are kept
+# with the reason so they can be reported before anything is sent.
+
+KEEP_FIRST = 'first'
+KEEP_LAST = 'last'
+KEEP_ALL = 'all'
+KEEP_POLICIES = (KEEP_FIRST, KEEP_LAST, KEEP_ALL)
+
+MISSING = 'missing'
+INVALID = 'invalid address'
+SUPPRESSED = 'suppressed'
+DUPLICATE = 'duplicate'
+REASONS = (MISSING, INVALID, SUPPRESSED, DUPLICATE)
+
+MAX_ADDRESS_LENGTH = 254
+SEPARATOR = r'[;,\n]'
+# One address of a multi-address cell: separators inside a quoted display
+# name or inside <...> do not split it.
+ADDRESS_ITEM = r'(?:"[^"\n]*"|<[^<>\n]*>|[^,;\n])+'
+_ATOM = r"[a-z0-9!#$%&'*+/=?^_`{|}~-]+"
+_LABEL = r'[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?'
+# Top-level domain: letters, or an internationalized one in punycode
+_TLD = r'(?:[a-z]{2,63}|xn--[a-z0-9-]{1,59})'
+ADDRESS_PATTERN = rf'{_ATOM}(?:\.{_ATOM})*@{_LABEL}(?:\.{_LABEL})*\.{_TLD}'
+# Part of a split cell's row key after the first address: "12/2", "12/3"
+PART_SEPARATOR = '/'
+
+
+def load_suppression(source):
+    # One address per line, or a CSV whose first column holds them; lines
+    # like "@example.com" suppress a whole domain. source is a path, a
+    # binary file object or text. Returns a set of normalized entries.
+    if isinstance(source, str) and '\n' not in source:
+        with open(source, encoding='utf-8-sig') as f:
+            text = f.read()
+    elif isinstance(source, str):
+        text = source
+    else:
+        data = source.read()
+        text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    entries = set()
+    for line in text.splitlines():
+        entry = line.split(',', 1)[0].strip().strip('"').lower()
+        if '@' in entry:
+            entries.add(entry)
+    return entries
+
+
+def normalize(values):
+    # Series of raw cells -> trimmed, lowercased addresses; "Name <a@b>"
+    # and "mailto:a@b" keep only the address.
+    text = values.astype(str).str.strip()
+    bracketed = text.str.contains('<', regex=False)
+    if bracketed.any():
+        inner = text[bracketed].str.extract(r'<([^<>]*)>', expand=False)
+        text = text.where(~bracketed, inner.fillna(text[bracketed]).str.strip())
+    text = text.str.lower()
+    mailto = text.str.startswith('mailto:')
+    if mailto.any():
+        text = text.where(~mailto, text.str.slice(len('mailto:')))
+    return text
+
+
+class RecipientValidator:
+    """Validates recipient chunks one after another.
+
+    apply() returns the rows to send, with the email column normalized;
+    rejected rows are collected in `rejected`. Deduplication spans the whole
+    file, so a validator is used for one pass over it. KEEP_LAST needs the
+    counts from prescan() over the same file first.
+    """
+
+    def __init__(self, emailcolumn, keep=KEEP_FIRST, suppressed=None, split=True):
+        if keep not in KEEP_POLICIES:
+            raise ValueError(f"unknown keep policy {keep!r}; use one of {', '.join(KEEP_POLICIES)}")
+        self.emailcolumn = emailcolumn
+        self.keep = keep
+        self.split = split
+        suppressed = suppressed or ()
+        self.suppressed = {entry for entry in suppressed if not entry.startswith('@')}
+        self.suppressed_domains = {entry[1:] for entry in suppressed if entry.startswith('@')}
+        self.total = 0
+        self.valid = 0
+        self.counts = dict.fromkeys(REASONS, 0)
+        self._rejected = []
+        self._seen = set()
+        self._remaining = None
+
+    def _split(self, chunk):
+        # One row per address; extra addresses get "<row>/2", "<row>/3"...
+        # as their row key, the first keeps the row's own key.
+        column = chunk[self.emailcolumn]
+        text = column.astype(str)
+        multi = column.notna() & text.str.contains(SEPARATOR, regex=True)
+        if not multi.any():
+            return chunk
+        parts = text[multi].str.findall(ADDRESS_ITEM).map(
+            lambda cell: [part.strip() for part in cell if part.strip()] or [''])
+        chunk = chunk.copy()
+        chunk[self.emailcolumn] = column.astype(object).where(~multi, parts)
+        chunk = chunk.explode(self.emailcolumn)
+        position = chunk.groupby(level=0, sort=False).cumcount()
+        if not (position > 0).any():
+            return chunk
+        keys = chunk.index.astype(str)
+        suffix = (PART_SEPARATOR + (position + 1).astype(str)).where(position > 0, '')
+        chunk.index = keys + suffix.to_numpy()
+        return chunk
+
+    def _check(self, chunk):
+        # (rows, normalized addresses, reason per row or None)
+        import pandas as pd
+
+        if self.split:
+            chunk = self._split(chunk)
+        raw = chunk[self.emailcolumn]
+        addresses = normalize(raw)
+        reasons = pd.Series(None, index=chunk.index, dtype=object)
+        missing = raw.isna().to_numpy() | (addresses == '').to_numpy()
+        reasons[missing] = MISSING
+        invalid = ~missing & ~(addresses.str.fullmatch(ADDRESS_PATTERN).fillna(False).to_numpy()
+                               & (addresses.str.len() <= MAX_ADDRESS_LENGTH).to_numpy())
+        reasons[invalid] = INVALID
+        if self.suppressed or self.suppressed_domains:
+            listed = addresses.isin(self.suppressed).to_numpy()
+            if self.suppressed_domains:
+                listed |= addresses.str.rpartition('@')[2].isin(self.suppressed_domains).to_numpy()
+            reasons[reasons.isna().to_numpy() & listed] = SUPPRESSED
+        return chunk, addresses, reasons
+
+    def prescan(self, chunks):
+        # KEEP_LAST: count each valid address over the file, so apply() can
+        # keep only its last occurrence.
+        from collections import Counter
+
+        counts = Counter()
+        for chunk in chunks:
+            _, addresses, reasons = self._check(chunk)
+            counts.update(addresses[reasons.isna().to_numpy()].tolist())
+        self._remaining = counts
+
+    def apply(self, chunk):
+        import numpy as np
+
+        chunk, addresses, reasons = self._check(chunk)
+        ok = reasons.isna().to_numpy()
+        if self.keep == KEEP_FIRST:
+            seen = self._seen
+            candidates = addresses[ok].tolist()
+            duplicate = np.empty(len(candidates), dtype=bool)
+            for position, address in enumerate(candidates):
+                duplicate[position] = address in seen
+                seen.add(address)
+            positions = np.flatnonzero(ok)[duplicate]
+        elif self.keep == KEEP_LAST:
+            if self._remaining is None:
+                raise RuntimeError("KEEP_LAST needs prescan() over the file first")
+            remaining = self._remaining
+            candidates = addresses[ok].tolist()
+            duplicate = np.empty(len(candidates), dtype=bool)
+            for position, address in enumerate(candidates):
+                remaining[address] -= 1
+                duplicate[position] = remaining[address] > 0
+            positions = np.flatnonzero(ok)[duplicate]
+        else:
+            positions = []
+        if len(positions):
+            reasons.iloc[positions] = DUPLICATE
+            ok[positions] = False
+
+        self.total += len(chunk)
+        self.valid += int(ok.sum())
+        if not ok.all():
+            rejected = ~ok
+            counts = reasons[rejected].value_counts()
+            for reason, count in counts.items():
+                self.counts[reason] += int(count)
+            self._record(chunk.index[rejected], chunk[self.emailcolumn][rejected], reasons[rejected])
+        chunk = chunk[ok]
+        if len(chunk):
+            chunk = chunk.assign(**{self.emailcolumn: addresses[ok].to_numpy()})
+        return chunk
+
+    def _record(self, keys, values, reasons):
+        import pandas as pd
+
+        values = values.astype(str).where(values.notna(), '')
+        self._rejected.append(pd.DataFrame({'row': keys.astype(str), 'value': values.to_numpy(),
+                                            'reason': reasons.to_numpy()}))
+
+    @property
+    def rejected(self):
+        # DataFrame of every rejected row: row key, cell value, reason.
+        import pandas as pd
+
+        if not self._rejected:
+            return pd.DataFrame(columns=['row', 'value', 'reason'])
+        if len(self._rejected) > 1:
+            self._rejected = [pd.concat(self._rejected, ignore_index=True)]
+        return self._rejected[0]
+
+    def report(self):
+        return {'total': self.total, 'valid': self.valid,
+                **{reason: count for reason, count in self.counts.items() if count}}